@@ -61,6 +61,7 @@ setup(
         "joblib",
         "junit-xml",
         "logless",
+        "psutil",
         "tqdm",
         "uio",
         "xmlrunner",
@@ -69,8 +70,8 @@ setup(
         "AWS": ["boto3", "s3fs"],
         "S3": ["boto3", "s3fs"],
         "Azure": ["azure-storage-blob", "azure-storage-file-datalake"],
-        "Pandas": ["pandas", "xlrd", "openpyxl"],
-        "Spark": ["pyspark"],
+        "Pandas": ["pandas", "xlrd", "openpyxl", "pyarrow"],
+        "Spark": ["pyspark", "pyarrow"],
     },
     classifiers=[
         "Development Status :: 4 - Beta",  # "4 - Beta" or "5 - Production/Stable"
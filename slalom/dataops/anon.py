@@ -2,17 +2,9 @@
 
 import hashlib
 
-import fire
-import uio
-
-try:
-    import pandas
-except ImportError as ex:
-    raise ImportError(
-        "Could not import Pandas library, which is required to perform "
-        "anonymization functions. You may be able to resolve this by running "
-        f"`pip install pandas`. Full error message: {ex}"
-    )
+from slalom.dataops.lazy_imports import lazy_import
+
+uio = lazy_import("uio")
 
 HASH_FUNCTIONS = {"MD5": hashlib.md5, "SHA256": hashlib.sha256, "SHA512": hashlib.sha512}
 
@@ -47,6 +39,15 @@ def anonymize_file(filepath: str, hash_key: str, hash_function: str = "MD5"):
     FileExistsError
         If the file cannot be found.
     """
+    try:
+        import pandas
+    except ImportError as ex:
+        raise ImportError(
+            "Could not import Pandas library, which is required to perform "
+            "anonymization functions. You may be able to resolve this by running "
+            f"`pip install pandas`. Full error message: {ex}"
+        )
+
     if hash_function not in HASH_FUNCTIONS:
         raise ValueError(
             f"Unsupported hash function {hash_function}. "
@@ -76,6 +77,8 @@ def anonymize_file(filepath: str, hash_key: str, hash_function: str = "MD5"):
 
 
 def main():
+    import fire
+
     fire.Fire({"anonymize": anonymize_file})
 
 
@@ -3,10 +3,12 @@ import os
 import platform
 import sys
 
-import fire
 from logless import get_logger, logged, logged_block
-import runnow
-import uio
+
+from slalom.dataops.lazy_imports import lazy_import
+
+runnow = lazy_import("runnow")
+uio = lazy_import("uio")
 
 if os.name == "nt":
     import ctypes
@@ -209,4 +211,6 @@ def install(program_name, install_cmd):
 
 
 if __name__ == "__main__":
+    import fire
+
     fire.Fire()
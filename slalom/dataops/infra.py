@@ -1,15 +1,15 @@
 #!/usr/bin/env python3
-from joblib import Parallel, delayed
 import os
 import sys
 from pathlib import Path
 from typing import Dict, List
 
-import fire
 from logless import get_logger, logged, logged_block
-import runnow
-from tqdm import tqdm
-import uio
+
+from slalom.dataops.lazy_imports import lazy_import
+
+runnow = lazy_import("runnow")
+uio = lazy_import("uio")
 
 code_file = os.path.realpath(__file__)
 repo_dir = os.path.dirname(os.path.dirname(os.path.dirname(code_file)))
@@ -50,6 +50,9 @@ def _update_var_output(output_var):
 
 @logged("updating output files")
 def update_var_outputs(infra_dir, output_vars=[]):
+    from joblib import Parallel, delayed
+    from tqdm import tqdm
+
     outputs_dir = os.path.join(infra_dir, "outputs")
     uio.create_folder(outputs_dir)
     for oldfile in uio.list_local_files(outputs_dir, recursive=False):
@@ -416,6 +419,8 @@ def change_upstream_source(
 
 
 def main():
+    import fire
+
     fire.Fire(
         {
             "install": install,
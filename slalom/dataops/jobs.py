@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import datetime
-from distutils.util import strtobool
 import hashlib
 
 # import inspect
@@ -12,8 +11,11 @@ import tempfile
 import time
 
 from logless import logged, get_logger, flush_buffers
-import runnow
-import uio
+
+from slalom.dataops.lazy_imports import lazy_import
+
+runnow = lazy_import("runnow")
+uio = lazy_import("uio")
 
 sys.path.append("../src/")
 if __name__ == "__main__" and __package__ is None:
@@ -24,9 +26,14 @@ if __name__ == "__main__" and __package__ is None:
 logging = get_logger("slalom.dataops")
 
 DATA_REPO_ROOT = "s3://propensity-to-buy/data"
-if "ARTIFACTS_ROOT" not in os.environ:
-    os.environ["ARTIFACTS_ROOT"] = tempfile.mkdtemp()
-ARTIFACTS_ROOT = os.environ["ARTIFACTS_ROOT"]
+_batch_id = None
+
+
+def get_artifacts_root():
+    """Return the artifacts root folder, creating a temp folder on first use if not set."""
+    if "ARTIFACTS_ROOT" not in os.environ:
+        os.environ["ARTIFACTS_ROOT"] = tempfile.mkdtemp()
+    return os.environ["ARTIFACTS_ROOT"]
 
 
 def init_batch_id():
@@ -40,9 +47,36 @@ def init_batch_id():
     return batch_id
 
 
+def get_batch_id():
+    """Return the batch ID, initializing it on first use."""
+    global _batch_id
+
+    if not _batch_id:
+        _batch_id = init_batch_id()
+    return _batch_id
+
+
+def __getattr__(name):
+    """Initialize BATCH_ID and ARTIFACTS_ROOT on first access rather than at import."""
+    if name == "BATCH_ID":
+        return get_batch_id()
+    if name == "ARTIFACTS_ROOT":
+        return get_artifacts_root()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def _strtobool(val):
+    """Return True or False for a string such as 'y', 'true', 'on', '0', or 'False'."""
+    val = val.lower()
+    if val in ["y", "yes", "t", "true", "on", "1"]:
+        return True
+    if val in ["n", "no", "f", "false", "off", "0"]:
+        return False
+    raise ValueError(f"Invalid truth value: '{val}'")
+
+
 # If debugging or if running in CI/CD, only do a dry run (much faster)
-BATCH_ID = init_batch_id()
-DEV_MODE = strtobool(os.environ.get("DEV_MODE", "0"))
+DEV_MODE = _strtobool(os.environ.get("DEV_MODE", "0"))
 DRY_RUN_MODE = DEV_MODE or ("CI" in os.environ)
 
 
@@ -142,7 +176,7 @@ def generate_script_output(
     if cmd:
         start_time = time.time()
         log_file_name = f"{os.path.basename(script_file_path)}.log"
-        log_file_path = os.path.join(ARTIFACTS_ROOT, log_file_name)
+        log_file_path = os.path.join(get_artifacts_root(), log_file_name)
         new_running_hash = get_appended_code_hash(parent_hash, script_file_path)
         parent_cache_folder, new_cache_folder = None, None
         if use_cache:
@@ -262,7 +296,7 @@ def run_jobs(job_steps, use_cache=True, save_cache=True):
     running_code_hash = hashlib.md5(app_version_seed.encode("utf-8")).hexdigest()
     for i, job_step in enumerate(job_steps, 1):
         is_last_job = i == len(job_steps)
-        output_dir = get_batch_folder_path(BATCH_ID)
+        output_dir = get_batch_folder_path(get_batch_id())
         running_code_hash = generate_script_output(
             script_file_path=job_step,
             parent_hash=running_code_hash,
@@ -0,0 +1,64 @@
+""" slalom.dataops.lazy_imports module """
+
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+_import_lock = threading.RLock()  # Imports of one module may trigger another's
+
+
+class _LazyModule(types.ModuleType):
+    """
+    A stand-in for a module which imports the real module on first attribute access.
+
+    The real import runs under a lock and completes before any attribute is returned,
+    so threads which first touch the module at the same time all see the full module.
+    """
+
+    def __init__(self, module_name):
+        super().__init__(module_name)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with _import_lock:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_lazy_module"] else "not yet loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(module_name):
+    """
+    Return a module which will not actually be loaded until its first attribute access,
+    or None if the module is not installed. Safe to first use from multiple threads.
+
+    Sample usage:
+
+        pd = lazy_import("pandas")  # Fast, even if pandas is never used
+        if pd:
+            df = pd.DataFrame()  # pandas is loaded here
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None or spec.loader is None:
+        return None
+    return _LazyModule(module_name)
@@ -1,23 +1,45 @@
 """ slalom.dataops.pandasutils module """
 
+import codecs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import csv
+import hashlib
+import importlib.util
+import json
 import os
+import threading
+import time
+from urllib.parse import quote
 
 from logless import (
     get_logger,
     logged,
     logged_block,
 )
-import uio
 
-USE_SCRATCH_DIR = False
+from slalom.dataops.lazy_imports import lazy_import
+
+uio = lazy_import("uio")
+
+USE_SCRATCH_DIR = os.environ.get("USE_SCRATCH_DIR", "false").lower() == "true"
+S3_CACHE_DIR = os.environ.get("S3_CACHE_DIR", None)  # Default: '{scratch_dir}/s3_cache'
+S3_CACHE_MAX_MB = int(os.environ.get("S3_CACHE_MAX_MB", 10240))
+READ_CSV_MAX_PARALLEL = int(os.environ.get("READ_CSV_MAX_PARALLEL", 8))
+PANDAS_CACHE_DIR = os.environ.get("PANDAS_CACHE_DIR", None)  # Set to enable the cache
+PANDAS_CACHE_MAX_MB = int(os.environ.get("PANDAS_CACHE_MAX_MB", 2048))
+# CSV engines in order of preference. Add 'pyarrow' to opt in (skipped if not installed)
+PANDAS_CSV_ENGINES = os.environ.get("PANDAS_CSV_ENGINES", "c,python").split(",")
+CSV_SNIFF_BYTES = int(os.environ.get("CSV_SNIFF_BYTES", 64 * 1024))
+CSV_COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".zip", ".xz", ".zst")
+EXCEL_CHUNK_ROWS = int(os.environ.get("EXCEL_CHUNK_ROWS", 50000))
+EXCEL_MAX_PARALLEL = int(os.environ.get("EXCEL_MAX_PARALLEL", os.cpu_count() or 1))
 
 logging = get_logger("slalom.dataops.sparkutils")
 
-try:
-    import pandas as pd
-except Exception as ex:
-    pd = None
-    logging.warning(f"Could not load pandas library. Try 'pip install pandas'. {ex}")
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+if not pd:
+    logging.warning("Could not load pandas library. Try 'pip install pandas'.")
 
 
 def _raise_if_missing_pandas(as_warning=False, ex=None):
@@ -29,59 +51,717 @@ def _raise_if_missing_pandas(as_warning=False, ex=None):
             raise RuntimeError(msg)
 
 
-def read_csv_dir(csv_dir, usecols=None, dtype=None):
+def _list_csv_dir(csv_dir):
+    """Return the data files in a folder, skipping markers such as '_SUCCESS'."""
+    return [
+        file_path
+        for file_path in uio.list_files(csv_dir)
+        if not os.path.basename(file_path).startswith(("_", "."))
+    ]
+
+
+_s3_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "downloaded_bytes": 0}
+_s3_cache_lock = threading.Lock()
+
+
+def get_s3_cache_stats():
+    """Return the hit, miss, eviction and download counts of the local S3 cache."""
+    with _s3_cache_lock:
+        return dict(_s3_cache_stats)
+
+
+def _get_s3_cache_dir():
+    return S3_CACHE_DIR or os.path.join(uio.get_scratch_dir(), "s3_cache")
+
+
+def _get_s3_object_info(s3_path):
+    """Return the size and ETag of an S3 object."""
+    import boto3
+
+    bucket, key = uio.parse_s3_path(s3_path)
+    response = boto3.client("s3").head_object(Bucket=bucket, Key=key)
+    return {"size": response["ContentLength"], "etag": response["ETag"]}
+
+
+def _increment_s3_cache_stat(stat_name, amount=1):
+    with _s3_cache_lock:
+        _s3_cache_stats[stat_name] += amount
+
+
+def get_cached_s3_file(s3_path):
+    """
+    Return the path to a local copy of the S3 file, downloading it only if the cached
+    copy is missing or its size or ETag no longer match the S3 object.
+
+    Downloads are written to a temp file and then renamed into place, so concurrent
+    threads and processes never read partial files. The least recently used files
+    are evicted when the cache exceeds S3_CACHE_MAX_MB.
+    """
+    cache_dir = _get_s3_cache_dir()
+    path_hash = hashlib.sha1(s3_path.encode("utf-8")).hexdigest()[:16]
+    local_path = os.path.join(cache_dir, f"{path_hash}-{os.path.basename(s3_path)}")
+    info_path = f"{local_path}.s3info"
+    object_info = _get_s3_object_info(s3_path)
+    try:
+        with open(info_path, "r") as f:
+            cached_info = json.load(f)
+        is_valid = (
+            cached_info == object_info
+            and os.path.getsize(local_path) == object_info["size"]
+        )
+    except (OSError, ValueError):
+        is_valid = False
+    if is_valid:
+        logging.debug(f"Using cached copy of '{s3_path}': '{local_path}'")
+        _increment_s3_cache_stat("hits")
+        os.utime(local_path)  # Mark as recently used
+        return local_path
+    _increment_s3_cache_stat("misses")
+    logging.info(f"Downloading S3 file '{s3_path}' to local cache: '{local_path}'")
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_suffix = f".{os.getpid()}-{threading.get_ident()}.tmp"
+    uio.download_s3_file(s3_path, local_path + temp_suffix)
+    with open(info_path + temp_suffix, "w") as f:
+        json.dump(object_info, f)
+    os.replace(local_path + temp_suffix, local_path)
+    os.replace(info_path + temp_suffix, info_path)
+    _increment_s3_cache_stat("downloaded_bytes", object_info["size"])
+    _evict_s3_cache(cache_dir, keep_path=local_path)
+    return local_path
+
+
+def _evict_s3_cache(cache_dir, max_mb=None, keep_path=None):
+    """Delete the least recently used files until the cache fits in max_mb."""
+    max_bytes = (S3_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    cached_files = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith((".s3info", ".tmp")) and entry.path != keep_path:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            cached_files.append((stat.st_mtime, stat.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in cached_files)
+    if keep_path:
+        total_bytes += os.path.getsize(keep_path)
+    for _, size, file_path in sorted(cached_files):
+        if total_bytes <= max_bytes:
+            break
+        logging.debug(f"Evicting '{file_path}' from local S3 cache.")
+        for path in [f"{file_path}.s3info", file_path]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total_bytes -= size
+        _increment_s3_cache_stat("evictions")
+
+
+def _get_read_path(file_path):
+    """Return the path to read from: a cached copy, if USE_SCRATCH_DIR is set."""
+    if USE_SCRATCH_DIR and uio.is_s3(file_path):
+        return get_cached_s3_file(file_path)
+    return file_path
+
+
+def _read_csv_file(file_path, usecols=None, dtype=None):
+    """Read a single CSV file, returning the dataframe and the read stats."""
+    start_time = time.time()
+    csv_path = _get_read_path(file_path)
+    df = pd.read_csv(csv_path, index_col=None, header=0, usecols=usecols, dtype=dtype)
+    stats = {
+        "file_path": file_path,
+        "rows": len(df),
+        "bytes": os.path.getsize(csv_path) if uio.is_local(csv_path) else None,
+        "seconds": time.time() - start_time,
+    }
+    return df, stats
+
+
+def _get_throughput_str(num_bytes, num_rows, seconds):
+    seconds = max(seconds, 0.001)
+    msg = f"{num_rows:,} rows in {seconds:.1f}s ({num_rows / seconds:,.0f} rows/s"
+    if num_bytes is not None:
+        msg += f", {_bytes_to_string(num_bytes / seconds)}/s"
+    return msg + ")"
+
+
+def iter_csv_dir(csv_dir, usecols=None, dtype=None, chunksize=None):
+    """
+    Yield dataframes from the CSV files in a local or S3 folder, in file name order.
+
+    If chunksize is None, one dataframe is yielded per file. Otherwise, each file is
+    read in chunks of up to chunksize rows, so only one chunk is held in memory at a
+    time. Chunks do not span files. Any usecols and dtype are applied to each chunk.
+    """
     _raise_if_missing_pandas()
-    df_list = []
-    for s3_path in uio.list_s3_files(csv_dir):
-        if "_SUCCESS" not in s3_path:
-            if USE_SCRATCH_DIR:
-                scratch_dir = uio.get_scratch_dir()
-                filename = os.path.basename(s3_path)
-                csv_path = os.path.join(scratch_dir, filename)
-                if os.path.exists(csv_path):
-                    logging.info(
-                        f"Skipping download of '{s3_path}'. File exists as: '{csv_path}' "
-                        "(If you do not want to use this file, please delete "
-                        "the file or unset the USE_SCRATCH_DIR environment variable.)"
+    for file_path in _list_csv_dir(csv_dir):
+        csv_path = _get_read_path(file_path)
+        logging.debug(f"Reading file: {file_path}")
+        if not chunksize:
+            yield pd.read_csv(
+                csv_path, index_col=None, header=0, usecols=usecols, dtype=dtype
+            )
+            continue
+        with pd.read_csv(
+            csv_path,
+            index_col=None,
+            header=0,
+            usecols=usecols,
+            dtype=dtype,
+            chunksize=chunksize,
+        ) as reader:
+            for chunk in reader:
+                yield chunk
+
+
+def _get_common_dtype(dtype_a, dtype_b):
+    """Return a numpy dtype which can hold values of both dtypes."""
+    if dtype_a is None:
+        dtype_a = dtype_b
+    if not isinstance(dtype_a, np.dtype) or not isinstance(dtype_b, np.dtype):
+        return np.dtype("object")  # e.g. strings and other extension types
+    try:
+        return np.result_type(dtype_a, dtype_b)
+    except TypeError:
+        return np.dtype("object")
+
+
+def concat_preallocated(get_chunks):
+    """
+    Concatenate dataframe chunks into a single, preallocated dataframe.
+
+    The get_chunks function must return a new iterable of chunks each time it is
+    called. The first pass counts rows and resolves the dtype of each column; the
+    second fills the preallocated columns, so peak memory is the result plus one
+    chunk, rather than about twice the result as with pd.concat(). Columns which are
+    not numpy types, such as strings, are returned as 'object' columns.
+    """
+    _raise_if_missing_pandas()
+    num_rows, dtypes = 0, {}
+    for chunk in get_chunks():
+        num_rows += len(chunk)
+        for col in chunk.columns:
+            dtypes[col] = _get_common_dtype(dtypes.get(col), chunk[col].dtype)
+    columns = {col: np.empty(num_rows, dtype=dtype) for col, dtype in dtypes.items()}
+    offset = 0
+    for chunk in get_chunks():
+        for col, values in columns.items():
+            values[offset : offset + len(chunk)] = chunk[col].to_numpy(
+                dtype=dtypes[col]
+            )
+        offset += len(chunk)
+    if offset != num_rows:
+        raise RuntimeError(
+            f"Row count changed between passes: expected {num_rows}, read {offset}."
+        )
+    return pd.DataFrame(columns, copy=False)
+
+
+def read_csv_dir(
+    csv_dir,
+    usecols=None,
+    dtype=None,
+    max_parallel=None,
+    preallocate=False,
+    chunksize=100000,
+    optimize_mem=False,
+    out_of_core=False,
+    dataset_dir=None,
+):
+    """
+    Read all CSV files in a local or S3 folder into a single dataframe.
+
+    Files are downloaded and parsed concurrently on up to max_parallel threads
+    (default: READ_CSV_MAX_PARALLEL), and concatenated in file name order.
+
+    If preallocate=True, files are instead read twice in chunks of chunksize rows and
+    copied into a preallocated result (see concat_preallocated()), trading parse time
+    for roughly half the peak memory.
+
+    If optimize_mem=True, the result is passed through optimize_pandas_mem_usage().
+
+    If out_of_core=True, the files are instead streamed to an on-disk Arrow dataset
+    and a memory-mapped pyarrow Dataset is returned, for data which does not fit in
+    memory. See csv_dir_to_arrow_dataset() and read_arrow_dataset().
+    """
+    _raise_if_missing_pandas()
+    if out_of_core:
+        return csv_dir_to_arrow_dataset(
+            csv_dir, dataset_dir=dataset_dir, usecols=usecols, dtype=dtype
+        )
+    if preallocate:
+        logging.info(f"Reading files from '{csv_dir}' into a preallocated dataframe...")
+        df = concat_preallocated(
+            lambda: iter_csv_dir(csv_dir, usecols, dtype, chunksize=chunksize)
+        )
+    else:
+        df = _read_csv_dir_concurrently(csv_dir, usecols, dtype, max_parallel)
+    if optimize_mem:
+        df, _ = optimize_pandas_mem_usage(df, csv_dir)
+    return df
+
+
+def _unify_arrow_types(type_a, type_b):
+    """Return a type which can hold values of both types: float64, or else string."""
+    import pyarrow as pa
+
+    if type_a == type_b or pa.types.is_null(type_b):
+        return type_a
+    if pa.types.is_null(type_a):
+        return type_b
+    if all(pa.types.is_integer(x) or pa.types.is_floating(x) for x in [type_a, type_b]):
+        return pa.float64()
+    return pa.string()
+
+
+def _widen_arrow_schema(read_path, schema, fixed_columns, read_options):
+    """
+    Stream the CSV file as strings and return the schema with any columns (except
+    fixed_columns) whose values don't all fit widened to float64 or string.
+    """
+    import pyarrow as pa
+    import pyarrow.csv
+
+    fields = {field.name: field for field in schema}
+    reader = pa.csv.open_csv(
+        read_path,
+        read_options=read_options,
+        convert_options=pa.csv.ConvertOptions(
+            column_types={name: pa.string() for name in fields},
+            include_columns=schema.names,
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        for name, column in zip(batch.schema.names, batch.columns):
+            field = fields[name]
+            if name in fixed_columns or pa.types.is_string(field.type):
+                continue
+            candidate_types = [field.type, pa.string()]
+            if pa.types.is_integer(field.type):
+                candidate_types.insert(1, pa.float64())
+            for new_type in candidate_types:
+                try:
+                    column.cast(new_type)
+                    break
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                    continue
+            fields[name] = pa.field(name, new_type)
+    return pa.schema([fields[name] for name in schema.names])
+
+
+def _write_arrow_file(reader, output_path, schema):
+    """Write the record batches of reader to an Arrow IPC file; return the row count."""
+    import pyarrow as pa
+
+    num_rows = 0
+    with pa.OSFile(output_path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                num_rows += batch.num_rows
+    return num_rows
+
+
+def _cast_arrow_file(file_path, schema):
+    """Rewrite an Arrow IPC file with a new (wider) schema."""
+    import pyarrow as pa
+
+    temp_path = f"{file_path}.tmp"
+    with pa.memory_map(file_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        with pa.OSFile(temp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table.cast(schema))
+    os.replace(temp_path, file_path)
+
+
+def csv_dir_to_arrow_dataset(
+    csv_dir, dataset_dir=None, usecols=None, dtype=None, block_size_mb=16
+):
+    """
+    Stream all CSV files in a local or S3 folder into an on-disk Arrow (Feather v2)
+    dataset, and return it as a memory-mapped pyarrow Dataset.
+
+    Each file is parsed in blocks of block_size_mb and written as it is read, so memory
+    use is bounded by the block size rather than the size of the data. Column types
+    are inferred from the first block of every file and unified (mixed integers and
+    floats become floats, other conflicts become strings), unless set by dtype, a dict
+    of column names to numpy dtypes. If a later block still doesn't fit, the affected
+    columns are widened in the same way and any files already written are rewritten.
+    The dataset is written to dataset_dir (default: a folder in the scratch dir),
+    replacing any prior contents. If the conversion fails, no partial dataset is left.
+    """
+    import pyarrow as pa
+    import pyarrow.csv
+    import pyarrow.dataset
+    import pyarrow.fs
+
+    if not dataset_dir:
+        dir_hash = hashlib.sha1(csv_dir.encode("utf-8")).hexdigest()[:16]
+        dataset_dir = os.path.join(uio.get_scratch_dir(), "arrow", dir_hash)
+    os.makedirs(dataset_dir, exist_ok=True)
+    for old_file in os.listdir(dataset_dir):
+        if old_file.endswith(".arrow"):
+            os.remove(os.path.join(dataset_dir, old_file))
+    fixed_types = {
+        col: pa.from_numpy_dtype(np.dtype(col_dtype))
+        for col, col_dtype in (dtype or {}).items()
+    }
+    read_options = pa.csv.ReadOptions(block_size=block_size_mb * 1024 * 1024)
+    start_time, num_rows = time.time(), 0
+    file_paths = _list_csv_dir(csv_dir)
+    output_paths = []
+    try:
+        schema = None
+        for file_path in file_paths:
+            # S3 files are fetched one at a time, so the cache needn't hold them all
+            file_schema = pa.csv.open_csv(
+                _get_local_path(file_path),
+                read_options=read_options,
+                convert_options=pa.csv.ConvertOptions(
+                    column_types=fixed_types, include_columns=usecols
+                ),
+            ).schema
+            if schema is None:
+                schema = file_schema
+                continue
+            schema = pa.schema(
+                [
+                    pa.field(
+                        field.name,
+                        _unify_arrow_types(
+                            field.type,
+                            file_schema.field(field.name).type
+                            if field.name in file_schema.names
+                            else field.type,
+                        ),
                     )
-                else:
+                    for field in schema
+                ]
+            )
+        if schema is not None:
+            # Null-typed columns can't hold the values found in later blocks:
+            schema = pa.schema(
+                [
+                    pa.field(field.name, pa.string())
+                    if pa.types.is_null(field.type)
+                    else field
+                    for field in schema
+                ]
+            )
+        for i, file_path in enumerate(file_paths):
+            read_path = _get_local_path(file_path)
+            output_path = os.path.join(dataset_dir, f"part-{i:05d}.arrow")
+            output_paths.append(output_path)
+            while True:
+                reader = pa.csv.open_csv(
+                    read_path,
+                    read_options=read_options,
+                    convert_options=pa.csv.ConvertOptions(
+                        column_types={field.name: field.type for field in schema},
+                        include_columns=usecols,
+                    ),
+                )
+                try:
+                    num_rows += _write_arrow_file(reader, output_path, schema)
+                    break
+                except pa.ArrowInvalid as ex:
+                    new_schema = _widen_arrow_schema(
+                        read_path, schema, fixed_types, read_options
+                    )
+                    if new_schema == schema:
+                        raise
                     logging.info(
-                        f"Downloading S3 file '{s3_path}' to scratch dir: '{csv_path}'"
+                        f"Column types changed in '{file_path}' ({ex}). "
+                        f"Widening the dataset schema to: {new_schema}"
                     )
-                uio.download_s3_file(s3_path, csv_path)
-            else:
-                logging.info(f"Reading from S3 file: {s3_path}")
-                csv_path = s3_path
-            df = pd.read_csv(
-                csv_path, index_col=None, header=0, usecols=usecols, dtype=dtype
+                    schema = new_schema
+                    for prior_path in output_paths[:-1]:
+                        _cast_arrow_file(prior_path, schema)
+            logging.info(f"[{i + 1}/{len(file_paths)}] Converted '{file_path}' to Arrow.")
+    except BaseException:
+        for output_path in output_paths:
+            for partial_path in [output_path, f"{output_path}.tmp"]:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+        raise
+    logging.info(
+        f"Converted {len(file_paths)} file(s) from '{csv_dir}' "
+        f"to Arrow dataset '{dataset_dir}': "
+        + _get_throughput_str(None, num_rows, time.time() - start_time)
+    )
+    return pa.dataset.dataset(
+        dataset_dir,
+        format="arrow",
+        filesystem=pa.fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def read_arrow_dataset(dataset, columns=None, filters=None, limit=None):
+    """
+    Return a pandas dataframe with only the columns and rows selected from the dataset.
+
+    Columns and filters are applied while scanning, so only the data selected is
+    converted to pandas. The filters may be a pyarrow.dataset expression, such as
+    `pyarrow.dataset.field("State") == "WA"`, or a list of (column, op, value) tuples
+    as in pandas.read_parquet(). If limit is provided, at most limit rows are read.
+    """
+    import pyarrow.dataset
+    import pyarrow.parquet
+
+    if isinstance(filters, (list, tuple)):
+        filters = pyarrow.parquet.filters_to_expression(filters)
+    if limit is not None:
+        return dataset.head(limit, columns=columns, filter=filters).to_pandas()
+    return dataset.to_table(columns=columns, filter=filters).to_pandas()
+
+
+def _read_csv_dir_concurrently(csv_dir, usecols=None, dtype=None, max_parallel=None):
+    start_time = time.time()
+    file_paths = _list_csv_dir(csv_dir)
+    max_parallel = max(1, min(len(file_paths), max_parallel or READ_CSV_MAX_PARALLEL))
+    logging.info(
+        f"Reading {len(file_paths)} file(s) from '{csv_dir}' "
+        f"using {max_parallel} thread(s)..."
+    )
+    df_list, all_stats = [None] * len(file_paths), []
+    # Finish importing the lazy-loaded modules before the workers first touch them
+    pd.read_csv, uio.is_local
+    with ThreadPoolExecutor(
+        max_workers=max_parallel, thread_name_prefix="read-csv"
+    ) as executor:
+        futures = {
+            executor.submit(_read_csv_file, file_path, usecols, dtype): i
+            for i, file_path in enumerate(file_paths)
+        }
+        for future in as_completed(futures):
+            df, stats = future.result()
+            df_list[futures[future]] = df
+            all_stats.append(stats)
+            logging.info(
+                f"[{len(all_stats)}/{len(file_paths)}] Read '{stats['file_path']}': "
+                + _get_throughput_str(stats["bytes"], stats["rows"], stats["seconds"])
             )
-            df_list.append(df)
+    known_bytes = [x["bytes"] for x in all_stats if x["bytes"] is not None]
+    logging.info(
+        f"Read {len(file_paths)} file(s) from '{csv_dir}': "
+        + _get_throughput_str(
+            sum(known_bytes) if len(known_bytes) == len(all_stats) else None,
+            sum(x["rows"] for x in all_stats),
+            time.time() - start_time,
+        )
+    )
     logging.info(f"Concatenating datasets from: {csv_dir}")
     ret_val = pd.concat(df_list, axis=0, ignore_index=True)
     logging.info("Dataset concatenation was successful.")
     return ret_val
 
 
-def get_pandas_df(source_path, usecols=None):
+_pandas_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def get_pandas_cache_stats():
+    """Return the hit, miss and eviction counts of the get_pandas_df() cache."""
+    return dict(_pandas_cache_stats)
+
+
+def _get_source_fingerprint(source_path):
+    """Return the size and modified time (or ETag, for S3) of the source file."""
+    file_path = source_path.split("/#")[0]
+    if uio.is_s3(file_path):
+        return _get_s3_object_info(file_path)
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _get_cache_path(source_path, cache_dir, **read_args):
+    cache_key = json.dumps(
+        {
+            "source": source_path,
+            "fingerprint": _get_source_fingerprint(source_path),
+            "read_args": read_args,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    cache_hash = hashlib.sha1(cache_key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{cache_hash}.parquet")
+
+
+def _evict_pandas_cache(cache_dir, max_mb=None):
+    """Delete the least recently used cache files until the cache fits in max_mb."""
+    max_bytes = (PANDAS_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    cache_files = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".parquet"):
+            stat = entry.stat()
+            cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in cache_files)
+    for _, size, file_path in sorted(cache_files):
+        if total_bytes <= max_bytes:
+            break
+        logging.debug(f"Evicting '{file_path}' from pandas cache.")
+        os.remove(file_path)
+        total_bytes -= size
+        _pandas_cache_stats["evictions"] += 1
+
+
+def get_pandas_df(source_path, usecols=None, use_cache=None, optimize_mem=False):
+    """
+    Return a pandas dataframe from a CSV file or Excel sheet.
+
+    If use_cache is True (default: True if PANDAS_CACHE_DIR is set), a Parquet copy of
+    the result is saved in PANDAS_CACHE_DIR and reused until the source's size, modified
+    time (or ETag) or the read options change. The least recently used copies are
+    evicted when the cache exceeds PANDAS_CACHE_MAX_MB.
+
+    If optimize_mem=True, the result is passed through optimize_pandas_mem_usage().
+    """
     if not pd:
         raise RuntimeError(
             "Could not execute get_pandas_df(): Pandas library not loaded."
         )
+    df = _get_pandas_df_with_cache(source_path, usecols=usecols, use_cache=use_cache)
+    if optimize_mem:
+        df, _ = optimize_pandas_mem_usage(df, source_path)
+    return df
+
+
+def _get_pandas_df_with_cache(source_path, usecols=None, use_cache=None):
+    if use_cache is None:
+        use_cache = bool(PANDAS_CACHE_DIR)
+    if not use_cache:
+        return _read_pandas_df(source_path, usecols=usecols)
+    cache_dir = PANDAS_CACHE_DIR or os.path.join(uio.get_scratch_dir(), "pandas_cache")
+    cache_path = _get_cache_path(source_path, cache_dir, usecols=usecols)
+    if os.path.exists(cache_path):
+        logging.debug(f"Reading '{source_path}' from pandas cache: '{cache_path}'")
+        _pandas_cache_stats["hits"] += 1
+        os.utime(cache_path)  # Mark as recently used
+        return pd.read_parquet(cache_path)
+    _pandas_cache_stats["misses"] += 1
+    df = _read_pandas_df(source_path, usecols=usecols)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(temp_path)
+        os.replace(temp_path, cache_path)
+    except Exception as ex:
+        logging.warning(f"Could not cache '{source_path}' as Parquet. {ex}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    else:
+        _evict_pandas_cache(cache_dir)
+    return df
+
+
+def _read_pandas_df(source_path, usecols=None):
     if ".xlsx" in source_path.lower():
         df = read_excel_sheet(source_path, usecols=usecols)
     else:
+        df = _read_csv_with_best_engine(source_path, usecols=usecols)
+    return df
+
+
+_csv_engine_records = {}
+
+
+def get_csv_engine_records():
+    """Return the engine and options which last succeeded in reading each CSV file."""
+    return dict(_csv_engine_records)
+
+
+def _detect_encoding(sample):
+    """Return the encoding of the sample bytes, based on BOMs and UTF-8 validity."""
+    for bom, encoding in [
+        (codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16"),
+    ]:
+        if sample.startswith(bom):
+            return encoding
+    for trim_bytes in range(4):  # The sample may end in a partial character
+        try:
+            sample[: len(sample) - trim_bytes].decode("utf-8")
+            return "utf-8"
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+def sniff_csv_format(file_path, sample_bytes=None):
+    """
+    Return read_csv() options for the encoding, delimiter and quote character of a
+    local CSV file, detected from the first sample_bytes (default: CSV_SNIFF_BYTES).
+    """
+    if file_path.lower().endswith(CSV_COMPRESSED_EXTENSIONS):
+        return {}
+    with open(file_path, "rb") as f:
+        sample = f.read(sample_bytes or CSV_SNIFF_BYTES)
+    encoding = _detect_encoding(sample)
+    lines = sample.decode(encoding, errors="ignore").splitlines()
+    if len(lines) > 1:
+        lines = lines[:-1]  # Ignore the last line, which may be incomplete
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines), delimiters=",\t;|")
+    except csv.Error:
+        return {"encoding": encoding}
+    return {
+        "encoding": encoding,
+        "sep": dialect.delimiter,
+        "quotechar": dialect.quotechar,
+    }
+
+
+def _get_csv_engines():
+    engines = [engine.strip() for engine in PANDAS_CSV_ENGINES if engine.strip()]
+    if "pyarrow" in engines and not importlib.util.find_spec("pyarrow"):
+        engines.remove("pyarrow")
+    return engines
+
+
+def _read_csv_with_best_engine(source_path, usecols=None):
+    """
+    Read a CSV file using the first engine which succeeds, starting from the engine
+    recorded for this file by a previous read.
+
+    By default the 'c' engine is tried first, then 'python' (see PANDAS_CSV_ENGINES).
+    The multithreaded 'pyarrow' engine is faster but opt-in, since its results can
+    differ: for example, ISO date columns are parsed as datetime.date objects rather
+    than left as strings. Options are sniffed up front for local files, rather than
+    by retrying after failures.
+    """
+    read_path = _get_read_path(source_path)
+    engines = _get_csv_engines()
+    record = _csv_engine_records.get(source_path)
+    if record:
+        read_args = record["read_args"]
+        engines = [record["engine"]] + [x for x in engines if x != record["engine"]]
+    elif uio.is_local(read_path):
+        read_args = sniff_csv_format(read_path)
+    else:
+        read_args = {}
+    last_ex = None
+    for engine in engines:
+        kwargs = dict(read_args, usecols=usecols, engine=engine)
+        if engine == "c":
+            kwargs["low_memory"] = False
         try:
-            df = pd.read_csv(source_path, low_memory=False, usecols=usecols)
+            df = pd.read_csv(read_path, **kwargs)
+        except OSError:
+            raise
         except Exception as ex:
-            if "Error tokenizing data. C error" in str(ex):
-                logging.warning(
-                    f"Failed read_csv() using default 'c' engine. "
-                    f"Retrying with engine='python'...\n{ex}"
-                )
-                df = pd.read_csv(source_path, usecols=usecols, engine="python")
-            else:
-                raise ex
-    return df
+            logging.warning(
+                f"Failed read_csv() of '{source_path}' using '{engine}' engine. "
+                f"Trying the next engine...\n{ex}"
+            )
+            last_ex = ex
+            continue
+        _csv_engine_records[source_path] = {"engine": engine, "read_args": read_args}
+        return df
+    raise last_ex
 
 
 def read_excel_sheet(sheet_path, usecols=None):
@@ -90,11 +770,267 @@ def read_excel_sheet(sheet_path, usecols=None):
     S3 paths are excepted.
     """
     _raise_if_missing_pandas()
-    filepath, sheetname = sheet_path.split("/#")
-    df = pd.read_excel(filepath, sheetname=sheetname, usecols=usecols)
+    filepath, sheet_name = sheet_path.split("/#")
+    df = pd.read_excel(_get_read_path(filepath), sheet_name=sheet_name, usecols=usecols)
     return df
 
 
+def _get_local_path(file_path):
+    """Return a local path for the file, using the local S3 cache for S3 files."""
+    if uio.is_s3(file_path):
+        return get_cached_s3_file(file_path)
+    return file_path
+
+
+def _stringify_object_columns(df):
+    """Convert mixed-type (object) columns to strings, leaving nulls as null."""
+    for col in [col for col in df.columns if df[col].dtype == object]:
+        df[col] = df[col].map(lambda x: x if x is None else str(x))
+    return df
+
+
+def iter_excel_chunks(file_path, sheet_names=None, chunk_rows=None, usecols=None):
+    """
+    Stream one or more sheets of an Excel workbook, yielding (sheet_name, df) tuples of
+    up to chunk_rows rows (default: EXCEL_CHUNK_ROWS).
+
+    The workbook is opened once, in read-only mode, so memory use is bounded by the
+    chunk size and not by the size of the workbook. If sheet_names is None, all sheets
+    are read. If provided, usecols is a list of column names or indexes.
+    """
+    _raise_if_missing_pandas()
+    import openpyxl
+
+    chunk_rows = chunk_rows or EXCEL_CHUNK_ROWS
+    if isinstance(sheet_names, str):
+        sheet_names = [sheet_names]
+    workbook = openpyxl.load_workbook(
+        _get_local_path(file_path), read_only=True, data_only=True
+    )
+    try:
+        for sheet_name in sheet_names or workbook.sheetnames:
+            rows = workbook[sheet_name].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            columns = [
+                f"Unnamed: {i}" if col is None else str(col)
+                for i, col in enumerate(header)
+            ]
+            col_indexes = list(range(len(columns)))
+            if usecols:
+                col_indexes = [
+                    col if isinstance(col, int) else columns.index(col)
+                    for col in usecols
+                ]
+            col_names = [columns[i] for i in col_indexes]
+            batch = []
+            for row in rows:
+                values = [row[i] if i < len(row) else None for i in col_indexes]
+                if all(value is None for value in values):
+                    continue  # Skip blank rows, including trailing formatted rows
+                batch.append(values)
+                if len(batch) >= chunk_rows:
+                    yield sheet_name, pd.DataFrame(batch, columns=col_names)
+                    batch = []
+            if batch:
+                yield sheet_name, pd.DataFrame(batch, columns=col_names)
+    finally:
+        workbook.close()
+
+
+def excel_to_parquet(
+    file_path, output_dir, sheet_names=None, chunk_rows=None, usecols=None, dtype=None
+):
+    """
+    Convert sheets of an Excel workbook to Parquet, streaming each chunk of rows
+    straight to Arrow. Returns the list of files written.
+
+    Each sheet is written to '{output_dir}/sheet={sheet_name}/'. Column types are
+    inferred from the first chunk of each sheet. If a later chunk doesn't fit, the
+    conflicting columns are widened (integers to floats, anything else to strings)
+    and the rows already written are rewritten with the wider schema. Pass dtype=str
+    to load all columns as strings.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    file_stem = os.path.splitext(os.path.basename(file_path))[0]
+    path_hash = hashlib.md5(file_path.encode("utf-8")).hexdigest()[:8]
+    file_name = f"{file_stem}-{path_hash}.parquet"
+    writers, output_files = {}, []
+    try:
+        for sheet_name, df in iter_excel_chunks(
+            file_path, sheet_names=sheet_names, chunk_rows=chunk_rows, usecols=usecols
+        ):
+            if dtype:
+                df = df.astype(dtype)
+            table = pa.Table.from_pandas(
+                _stringify_object_columns(df), preserve_index=False
+            )
+            if sheet_name not in writers:
+                schema = pa.schema(
+                    [
+                        pa.field(field.name, pa.string())
+                        if pa.types.is_null(field.type)
+                        else field
+                        for field in table.schema
+                    ]
+                )
+                sheet_dir = os.path.join(
+                    output_dir, f"sheet={quote(sheet_name, safe=' ')}"
+                )
+                os.makedirs(sheet_dir, exist_ok=True)
+                output_file = os.path.join(sheet_dir, file_name)
+                writers[sheet_name] = pq.ParquetWriter(output_file, schema)
+                output_files.append(output_file)
+            writer = writers[sheet_name]
+            schema = _widen_schema(writer.schema, table)
+            if schema != writer.schema:
+                logging.info(
+                    f"Column types changed within sheet '{sheet_name}' of "
+                    f"'{file_path}'. Widening the columns to: {schema}"
+                )
+                output_file = output_files[list(writers).index(sheet_name)]
+                writer = writers[sheet_name] = _rewrite_parquet_file(
+                    writer, output_file, schema
+                )
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return output_files
+
+
+def _widen_schema(schema, table):
+    """
+    Return the schema with any fields which can't hold the values of table widened:
+    integers to floats, and anything else to strings.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for field in schema:
+        column = table.column(field.name)
+        candidate_types = [field.type, pa.string()]
+        if pa.types.is_integer(field.type) and pa.types.is_floating(column.type):
+            candidate_types.insert(1, pa.float64())
+        for new_type in candidate_types:
+            try:
+                column.cast(new_type)
+                break
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                continue
+        fields.append(pa.field(field.name, new_type))
+    return pa.schema(fields)
+
+
+def _rewrite_parquet_file(writer, output_file, schema):
+    """
+    Close the writer, rewrite the row groups already in output_file with the new
+    schema, and return a new writer (with the file still open) for further rows.
+    """
+    import pyarrow.parquet as pq
+
+    writer.close()
+    folder, file_name = os.path.split(output_file)
+    old_file = os.path.join(folder, f".{file_name}.widening")  # Hidden from readers
+    os.replace(output_file, old_file)
+    new_writer = pq.ParquetWriter(output_file, schema)
+    with open(old_file, "rb") as f:
+        old_parquet = pq.ParquetFile(f)
+        for i in range(old_parquet.num_row_groups):
+            new_writer.write_table(old_parquet.read_row_group(i).cast(schema))
+    os.remove(old_file)
+    return new_writer
+
+
+@logged("converting Excel workbooks to Parquet in '{output_dir}'")
+def excel_files_to_parquet(file_paths, output_dir, n_jobs=None, **kwargs):
+    """
+    Convert many Excel workbooks to Parquet in parallel processes (up to n_jobs,
+    default: EXCEL_MAX_PARALLEL). Additional keyword args are passed to
+    excel_to_parquet(). Returns the list of files written.
+
+    Column types are then unified across all files (mixed integers and floats become
+    floats, other conflicts become strings, and columns with no values in a file take
+    the type from the other files), so that the files can be read as one dataset.
+    """
+    from joblib import Parallel, delayed
+
+    file_paths = list(file_paths)
+    n_jobs = max(1, min(len(file_paths), n_jobs or EXCEL_MAX_PARALLEL))
+    results = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(excel_to_parquet)(file_path, output_dir, **kwargs)
+        for file_path in file_paths
+    )
+    output_files = [output_file for files in results for output_file in files]
+    file_schemas = _get_unified_parquet_schemas(output_files)
+    if file_schemas:
+        logging.info(
+            f"Unifying column types of {len(file_schemas)} Parquet file(s) "
+            f"in '{output_dir}'..."
+        )
+        n_jobs = max(1, min(len(file_schemas), n_jobs))
+        Parallel(n_jobs=n_jobs, backend="loky")(
+            delayed(_cast_parquet_file)(output_file, schema)
+            for output_file, schema in file_schemas.items()
+        )
+    return output_files
+
+
+def _get_unified_parquet_schemas(file_paths):
+    """
+    Return a dict of {file_path: schema} for each Parquet file which needs casting so
+    that every column has the same type in all of the files.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schemas, unified_types = {}, {}
+    for file_path in file_paths:
+        metadata = pq.read_metadata(file_path)
+        schema = metadata.schema.to_arrow_schema()
+        schemas[file_path] = schema
+        for i, field in enumerate(schema):
+            null_count = 0
+            for row_group in range(metadata.num_row_groups):
+                stats = metadata.row_group(row_group).column(i).statistics
+                null_count += (stats.null_count or 0) if stats is not None else 0
+            # Excel columns with no values are typed as strings, which shouldn't win
+            column_type = pa.null() if null_count == metadata.num_rows else field.type
+            unified_types[field.name] = _unify_arrow_types(
+                unified_types.get(field.name, pa.null()), column_type
+            )
+    results = {}
+    for file_path, schema in schemas.items():
+        new_schema = pa.schema(
+            [
+                pa.field(field.name, unified_types[field.name])
+                if not pa.types.is_null(unified_types[field.name])
+                else field
+                for field in schema
+            ]
+        )
+        if new_schema.types != schema.types:
+            results[file_path] = new_schema
+    return results
+
+
+def _cast_parquet_file(file_path, schema):
+    """Rewrite a Parquet file with a new schema, one row group at a time."""
+    import pyarrow.parquet as pq
+
+    folder, file_name = os.path.split(file_path)
+    temp_path = os.path.join(folder, f".{file_name}.casting")  # Hidden from readers
+    with pq.ParquetWriter(temp_path, schema) as writer:
+        with open(file_path, "rb") as f:
+            parquet_file = pq.ParquetFile(f)
+            for i in range(parquet_file.num_row_groups):
+                writer.write_table(parquet_file.read_row_group(i).cast(schema))
+    os.replace(temp_path, file_path)
+
+
 def _bytes_to_string(num_bytes, units=None):
     """
     Return a string that efficiently represents the number of bytes.
@@ -167,9 +1103,111 @@ def print_pandas_mem_usage(df, df_name, print_fn=logging.info, min_col_size_mb=5
         col_usage_str = ", ".join(
             [
                 f"{col}({'Index' if col == 'Index' else df[col].dtype}):{size}"
-                for col, size in col_mem_usage.iteritems()
+                for col, size in col_mem_usage.items()
             ]
         )
         msg += f". Largest columns (over {min_col_size_mb}MB): {col_usage_str}"
     print_fn(msg)
     return msg
+
+
+def _get_col_mem_usage(series):
+    return series.memory_usage(index=False, deep=True)
+
+
+def _downcast_numeric(series):
+    """Return the smallest numeric series which holds exactly the same values."""
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series
+    if pd.api.types.is_integer_dtype(series.dtype):
+        downcast = "unsigned" if len(series) and series.min() >= 0 else "integer"
+        return pd.to_numeric(series, downcast=downcast)
+    downcast_series = pd.to_numeric(series, downcast="float")
+    if np.array_equal(
+        downcast_series.to_numpy(dtype="float64"),
+        series.to_numpy(dtype="float64"),
+        equal_nan=True,
+    ):
+        return downcast_series
+    return series  # Downcasting would lose precision
+
+
+def _get_optimized_column(series, category_max_ratio, sparse_min_null_ratio):
+    num_rows = len(series)
+    if not num_rows:
+        return series
+    null_ratio = series.isna().sum() / num_rows
+    if pd.api.types.is_numeric_dtype(series.dtype) and isinstance(
+        series.dtype, np.dtype
+    ):
+        series = _downcast_numeric(series)
+        if null_ratio >= sparse_min_null_ratio and series.dtype.kind == "f":
+            series = series.astype(pd.SparseDtype(series.dtype, np.nan))
+        return series
+    if pd.api.types.infer_dtype(series, skipna=True) != "string":
+        return series
+    if series.nunique(dropna=True) / num_rows <= category_max_ratio:
+        return series.astype("category")
+    if importlib.util.find_spec("pyarrow") and str(series.dtype) != "string":
+        return series.astype("string[pyarrow]")
+    return series
+
+
+def optimize_pandas_mem_usage(
+    df,
+    df_name="dataframe",
+    category_max_ratio=0.5,
+    sparse_min_null_ratio=0.9,
+    print_fn=logging.info,
+    min_col_size_mb=500,
+):
+    """
+    Reduce the memory used by a dataframe, returning the new dataframe and a report.
+
+    Each column is converted to the smallest of these representations which holds the
+    same values, if it uses less memory than the original:
+
+    - Integers and floats are downcast, as long as no precision is lost.
+    - Strings are converted to 'category' if the ratio of distinct values to rows is at
+      most category_max_ratio, or otherwise to Arrow-backed strings.
+    - Float columns with at least sparse_min_null_ratio nulls are made sparse.
+
+    The report includes before and after messages in the format of
+    print_pandas_mem_usage(), as well as the bytes used and the dtype changes.
+    """
+    _raise_if_missing_pandas()
+    before_bytes = df.memory_usage(index=True, deep=True).sum()
+    before_msg = print_pandas_mem_usage(df, df_name, lambda msg: None, min_col_size_mb)
+    dtype_changes = {}
+    df = df.copy(deep=False)
+    for col in df.columns:
+        series = df[col]
+        try:
+            new_series = _get_optimized_column(
+                series, category_max_ratio, sparse_min_null_ratio
+            )
+        except (TypeError, ValueError) as ex:
+            logging.debug(f"Could not optimize column '{col}' of '{df_name}': {ex}")
+            continue
+        if new_series is not series and (
+            _get_col_mem_usage(new_series) < _get_col_mem_usage(series)
+        ):
+            dtype_changes[col] = (str(series.dtype), str(new_series.dtype))
+            df[col] = new_series
+    after_bytes = df.memory_usage(index=True, deep=True).sum()
+    after_msg = print_pandas_mem_usage(df, df_name, lambda msg: None, min_col_size_mb)
+    print_fn(
+        f"Optimized memory usage of '{df_name}' from {_bytes_to_string(before_bytes)} "
+        f"to {_bytes_to_string(after_bytes)} "
+        f"({before_bytes / max(after_bytes, 1):.1f}x smaller). "
+        f"Converted {len(dtype_changes)} column(s).\n"
+        f"Before: {before_msg}\nAfter: {after_msg}"
+    )
+    report = {
+        "before": before_msg,
+        "after": after_msg,
+        "before_bytes": int(before_bytes),
+        "after_bytes": int(after_bytes),
+        "dtype_changes": dtype_changes,
+    }
+    return df, report
@@ -0,0 +1,281 @@
+""" slalom.dataops.profiling module """
+
+from contextlib import contextmanager
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+from logless import get_logger
+
+from slalom.dataops.lazy_imports import lazy_import
+
+psutil = lazy_import("psutil")
+sparkutils = lazy_import("slalom.dataops.sparkutils")
+
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.1))
+PROFILE_TRACE_MEMORY = (
+    os.environ.get("PROFILE_TRACE_MEMORY", "true").lower() == "true"
+)  # Python allocation tracing adds overhead; disable for production jobs
+
+logging = get_logger("slalom.dataops.profiling")
+
+_profile_records = []
+_block_sequence = itertools.count()
+_active_blocks = []
+_active_blocks_lock = threading.Lock()
+_sampler_thread = None
+_thread_state = threading.local()
+
+
+def _get_rss_bytes():
+    if not psutil:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def _to_mb(num_bytes):
+    if num_bytes is None:
+        return None
+    return round(num_bytes / (1024 * 1024), 1)
+
+
+def _sample_rss():
+    """Update the peak RSS of all active blocks until no blocks remain."""
+    global _sampler_thread
+
+    while True:
+        rss = _get_rss_bytes()
+        with _active_blocks_lock:
+            if not _active_blocks:
+                _sampler_thread = None
+                return
+            for block in _active_blocks:
+                block["_peak_rss"] = max(block["_peak_rss"], rss)
+        time.sleep(PROFILE_SAMPLE_INTERVAL)
+
+
+def _start_sampling(block):
+    global _sampler_thread
+
+    with _active_blocks_lock:
+        _active_blocks.append(block)
+        if psutil and not _sampler_thread:
+            _sampler_thread = threading.Thread(
+                target=_sample_rss, name="profile-rss-sampler", daemon=True
+            )
+            _sampler_thread.start()
+
+
+def _stop_sampling(block):
+    with _active_blocks_lock:
+        _active_blocks.remove(block)
+
+
+def _get_spark_memory():
+    """
+    Return the driver JVM heap used and the storage memory used by all block managers,
+    including the driver's (which is the only one in local mode).
+    """
+    spark_context = sparkutils.sc
+    if not spark_context:
+        return {}
+    runtime = spark_context._jvm.java.lang.Runtime.getRuntime()
+    results = {
+        "spark_driver_heap_mb": _to_mb(runtime.totalMemory() - runtime.freeMemory())
+    }
+    try:
+        executors = sparkutils._get_spark_api_json("executors")
+    except Exception as ex:
+        logging.debug(f"Could not get Spark executor memory: {ex}")
+        return results
+    results["spark_executor_storage_mb"] = _to_mb(sum(x["memoryUsed"] for x in executors))
+    results["spark_executor_max_mb"] = _to_mb(sum(x["maxMemory"] for x in executors))
+    return results
+
+
+@contextmanager
+def profile_block(name, trace_memory=None, spark=False, log_fn=logging.info):
+    """
+    Profile the wall time and memory of the code in the with block.
+
+    Records the wall time, RSS at start and end, peak RSS (sampled every
+    PROFILE_SAMPLE_INTERVAL seconds, requires psutil), and the peak of Python
+    allocations traced by tracemalloc (if trace_memory is True, default:
+    PROFILE_TRACE_MEMORY). If spark=True, Spark driver heap and block manager storage
+    memory are also recorded at the end of the block.
+
+    Before Python 3.9 (e.g. on Python 3.7), tracemalloc has no reset_peak(), so the
+    traced peak is only recorded for the outermost traced block. Nested blocks then
+    have a traced_peak_mb of None; use their peak RSS instead.
+
+    Blocks may be nested, and the peaks of nested blocks are included in their
+    parents. The record is yielded, and added to get_profile_records() on exit.
+
+    Sample usage:
+
+        with profile_block("load accounts"):
+            df = get_pandas_df("accounts.csv")
+    """
+    trace_memory = PROFILE_TRACE_MEMORY if trace_memory is None else trace_memory
+    can_reset_peak = hasattr(tracemalloc, "reset_peak")  # Python 3.9+
+    stack = getattr(_thread_state, "stack", None)
+    if stack is None:
+        stack = _thread_state.stack = []
+    parent = stack[-1] if stack else None
+    record = {
+        "name": name,
+        "path": f"{parent['path']}/{name}" if parent else name,
+        "depth": len(stack),
+        "sequence": next(_block_sequence),
+        "start_time": time.time(),
+    }
+    started_tracing = False
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        # Without reset_peak(), the traced peak is only known for the outermost block
+        if can_reset_peak or started_tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if parent and "_traced_peak" in parent:
+                parent["_traced_peak"] = max(parent["_traced_peak"], peak)
+            if can_reset_peak:
+                tracemalloc.reset_peak()
+            record["_traced_start"], record["_traced_peak"] = current, current
+    rss_start = _get_rss_bytes()
+    record["_peak_rss"] = rss_start or 0
+    _start_sampling(record)
+    stack.append(record)
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - start_time, 3)
+        stack.pop()
+        _stop_sampling(record)
+        rss_end = _get_rss_bytes()
+        record["rss_start_mb"] = _to_mb(rss_start)
+        record["rss_end_mb"] = _to_mb(rss_end)
+        record["peak_rss_mb"] = _to_mb(
+            max(record.pop("_peak_rss"), rss_end) if psutil else None
+        )
+        if parent and record["peak_rss_mb"] is not None:
+            parent["_peak_rss"] = max(parent["_peak_rss"], rss_end)
+        if "_traced_start" in record and tracemalloc.is_tracing():
+            peak = max(record.pop("_traced_peak"), tracemalloc.get_traced_memory()[1])
+            record["traced_peak_mb"] = _to_mb(peak - record.pop("_traced_start"))
+            if parent and "_traced_peak" in parent:
+                parent["_traced_peak"] = max(parent["_traced_peak"], peak)
+            if can_reset_peak:
+                tracemalloc.reset_peak()
+        if started_tracing:
+            tracemalloc.stop()
+        if spark:
+            record.update(_get_spark_memory())
+        _profile_records.append(record)
+        if log_fn:
+            log_fn(f"Profiled '{record['path']}': {_format_record(record)}")
+
+
+def profiled(name=None, **profile_kwargs):
+    """
+    Decorator to profile each call of a function. See profile_block() for arguments.
+
+    Sample usage:
+
+        @profiled()
+        def build_features(df):
+            ...
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapped_fn(*args, **kwargs):
+            with profile_block(name or f"{fn.__name__}()", **profile_kwargs):
+                return fn(*args, **kwargs)
+
+        return wrapped_fn
+
+    return decorator
+
+
+def _format_record(record):
+    msg = f"{record['wall_seconds']:.2f}s"
+    if record.get("peak_rss_mb") is not None:
+        msg += (
+            f", RSS {record['rss_start_mb']}MB -> {record['rss_end_mb']}MB "
+            f"(peak {record['peak_rss_mb']}MB)"
+        )
+    if record.get("traced_peak_mb") is not None:
+        msg += f", Python allocations peak +{record['traced_peak_mb']}MB"
+    if record.get("spark_driver_heap_mb") is not None:
+        msg += f", Spark driver heap {record['spark_driver_heap_mb']}MB"
+    if record.get("spark_executor_storage_mb") is not None:
+        msg += f", Spark executor storage {record['spark_executor_storage_mb']}MB"
+    return msg
+
+
+def get_profile_records():
+    """Return the completed profile records, in order of completion."""
+    return list(_profile_records)
+
+
+def clear_profile_records():
+    del _profile_records[:]
+
+
+def get_profile_summary(records=None):
+    """Return a text table summarizing the profile records, in order of start."""
+    records = sorted(
+        get_profile_records() if records is None else records,
+        key=lambda x: x["sequence"],
+    )
+    columns = [
+        ("Block", None),
+        ("Wall (s)", "wall_seconds"),
+        ("RSS End (MB)", "rss_end_mb"),
+        ("Peak RSS (MB)", "peak_rss_mb"),
+        ("Py Peak (MB)", "traced_peak_mb"),
+        ("Spark Exec (MB)", "spark_executor_storage_mb"),
+    ]
+    rows = [
+        ["  " * x["depth"] + x["name"]]
+        + ["" if x.get(key) is None else str(x[key]) for _, key in columns[1:]]
+        for x in records
+    ]
+    widths = [
+        max([len(header)] + [len(row[i]) for row in rows])
+        for i, (header, _) in enumerate(columns)
+    ]
+    lines = [
+        "  ".join(
+            header.ljust(width) if i == 0 else header.rjust(width)
+            for i, ((header, _), width) in enumerate(zip(columns, widths))
+        ),
+        "  ".join("-" * width for width in widths),
+    ]
+    for row in rows:
+        lines.append(
+            "  ".join(
+                value.ljust(width) if i == 0 else value.rjust(width)
+                for i, (value, width) in enumerate(zip(row, widths))
+            )
+        )
+    return "\n".join(lines)
+
+
+def print_profile_summary(records=None, print_fn=logging.info):
+    msg = get_profile_summary(records)
+    print_fn(f"Profile summary:\n{msg}")
+    return msg
+
+
+def save_profile_json(file_path, records=None):
+    """Save the profile records to a JSON file."""
+    records = get_profile_records() if records is None else records
+    with open(file_path, "w") as f:
+        json.dump(records, f, indent=2)
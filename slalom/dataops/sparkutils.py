@@ -1,62 +1,91 @@
 """ slalom.dataops.sparkutils module """
 
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 import datetime
+from fnmatch import fnmatch
+import functools
+import hashlib
 import importlib.util
+import json
+from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
 import time
 import os
+import re
+import shutil
 import sys
+import threading
+import uuid
 
 from pathlib import Path
 
-import docker
-import fire
-import pyspark
-from py4j.java_gateway import java_import
-from pyspark import SparkContext, SparkConf
-from pyspark.sql import SparkSession
-from pyspark.sql.types import (
-    StructType,
-    StructField,
-    DateType,
-    TimestampType,
-    Row as SparkRow,
-)
-from pyspark.sql.functions import (
-    unix_timestamp,
-    from_unixtime,
-    to_date,
-    input_file_name,
-    lit,
-)
-
-import dock_r
 from logless import (
     get_logger,
     logged,
     logged_block,
 )
-import runnow
-import uio
 
-from slalom.dataops import pandasutils
+from slalom.dataops.lazy_imports import lazy_import
+
+# Heavy libraries are loaded on first use, so the CLI and imports stay fast.
+runnow = lazy_import("runnow")
+uio = lazy_import("uio")
+pandasutils = lazy_import("slalom.dataops.pandasutils")
 
 logging = get_logger("slalom.dataops.sparkutils")
 
-try:
-    import pandas as pd
-except Exception as ex:
-    pd = None
-    logging.warning(f"Could not load pandas library. Try 'pip install pandas'. {ex}")
+pd = lazy_import("pandas")
+if not pd:
+    logging.warning("Could not load pandas library. Try 'pip install pandas'.")
 
 ENV_VAR_SPARK_UDF_MODULE = "SPARK_UDF_MODULE"
+SPARK_UDF_DEFAULT_RETURN_TYPE = os.environ.get("SPARK_UDF_DEFAULT_RETURN_TYPE", "string")
+_UDF_SKIP_NAMES = ["udf", "pandas_udf"]
+SPARK_UDF_LAZY_LOAD = os.environ.get("SPARK_UDF_LAZY_LOAD", "false").lower() in (
+    "true",
+    "1",
+    "yes",
+)
+UDF_MANIFEST_FILE_NAME = ".udf_manifest.json"
 
 _SERVING_SPARK_REQUESTS = "serving spark requests"
 ENABLE_SQL_JDBC = bool(os.environ.get("ENABLE_SQL_JDBC", False))
-METASTORE_TYPE = os.environ.get("METASTORE_TYPE", "Derby")
+THRIFT_PORT = int(os.environ.get("THRIFT_PORT", 10000))
+THRIFT_STARTUP_TIMEOUT = int(os.environ.get("THRIFT_STARTUP_TIMEOUT", 120))
+THRIFT_INCREMENTAL_COLLECT = (
+    os.environ.get("THRIFT_INCREMENTAL_COLLECT", "true").lower() == "true"
+)  # Stream Thrift results to clients one partition at a time
+SPARK_DRIVER_MAX_RESULT_SIZE = os.environ.get("SPARK_DRIVER_MAX_RESULT_SIZE", "1g")
+METASTORE_TYPE = os.environ.get(
+    "METASTORE_TYPE", "Derby"
+)  # Derby, DerbyInMemory, InMemory, MySQL
 METASTORE_SERVER = os.environ.get("METASTORE_SERVER", None) or "localhost"
 METASTORE_DB_USER = os.environ.get("METASTORE_DB_USER", None)
 METASTORE_DB_PASSWORD = os.environ.get("METASTORE_DB_PASSWORD", None)
-SUPPORT_CLUSTER_BY = False
+METASTORE_POOL_TYPE = os.environ.get("METASTORE_POOL_TYPE", "BONECP")
+METASTORE_POOL_SIZE = int(os.environ.get("METASTORE_POOL_SIZE", 10))
+SPARK_COMPUTE_TABLE_STATS = os.environ.get(
+    "SPARK_COMPUTE_TABLE_STATS", "false"
+).lower() in ("true", "1", "yes")
+SPARK_DEFAULT_NUM_BUCKETS = int(os.environ.get("SPARK_DEFAULT_NUM_BUCKETS", 16))
+SPARK_QUERY_CACHE_ENABLED = os.environ.get(
+    "SPARK_QUERY_CACHE_ENABLED", "false"
+).lower() in ("true", "1", "yes")
+SPARK_QUERY_CACHE_MAX_MB = int(os.environ.get("SPARK_QUERY_CACHE_MAX_MB", 2048))
+SPARK_QUERY_CACHE_STORAGE_LEVEL = os.environ.get(
+    "SPARK_QUERY_CACHE_STORAGE_LEVEL", "MEMORY_AND_DISK"
+)  # Any pyspark.StorageLevel name, e.g. MEMORY_ONLY, DISK_ONLY
+SPARK_SCHEDULER_MODE = os.environ.get("SPARK_SCHEDULER_MODE", None)  # FAIR, FIFO
+SPARK_SCHEDULER_ALLOCATION_FILE = os.environ.get("SPARK_SCHEDULER_ALLOCATION_FILE", None)
+SPARK_MAX_PARALLEL_BUILDS = int(os.environ.get("SPARK_MAX_PARALLEL_BUILDS", 4))
+SPARK_METRICS_ENABLED = (
+    os.environ.get("SPARK_METRICS_ENABLED", "true").lower() == "true"
+)  # Capture job/stage metrics for each table operation
+SPARK_METRICS_LOG_FILE = os.environ.get("SPARK_METRICS_LOG_FILE", None)  # JSON lines
+SPARK_DIAGNOSTICS_IN_BACKGROUND = os.environ.get(
+    "SPARK_DIAGNOSTICS_IN_BACKGROUND", "false"
+).lower() in ("true", "1", "yes")
 
 DOCKER_SPARK_IMAGE = os.environ.get("DOCKER_SPARK_IMAGE", "slalomggp/dataops:latest-dev")
 CONTAINER_ENDPOINT = "spark://localhost:7077"
@@ -64,6 +93,21 @@ SPARK_DRIVER_MEMORY = "4g"
 SPARK_EXECUTOR_MEMORY = "4g"
 SPARK_WAREHOUSE_DIR = os.environ.get("SPARK_WAREHOUSE_DIR", "/spark_warehouse/data")
 SPARK_S3_PREFIX = "s3a://"
+SPARK_TABLE_FORMAT = os.environ.get("SPARK_TABLE_FORMAT", "parquet")  # parquet, delta
+SPARK_DELTA_DIR = os.environ.get(
+    "SPARK_DELTA_DIR", os.path.join(SPARK_WAREHOUSE_DIR, "delta")
+)
+SPARK_DELTA_TARGET_FILE_MB = int(os.environ.get("SPARK_DELTA_TARGET_FILE_MB", 128))
+SPARK_COMPACT_TARGET_FILE_MB = int(os.environ.get("SPARK_COMPACT_TARGET_FILE_MB", 128))
+SPARK_DELTA_RETENTION_HOURS = int(os.environ.get("SPARK_DELTA_RETENTION_HOURS", 168))
+SPARK_INGEST_MANIFEST_DIR = os.environ.get(
+    "SPARK_INGEST_MANIFEST_DIR", os.path.join(SPARK_WAREHOUSE_DIR, "_manifests")
+)
+SPARK_STAGING_DIR = os.environ.get(  # Must be readable by the executors
+    "SPARK_STAGING_DIR", os.path.join(SPARK_WAREHOUSE_DIR, "_staging")
+)
+DELTA_WRITE_MODES = ["overwrite", "append", "merge", "overwrite_partitions"]
+SPARK_ARROW_BATCH_SIZE = int(os.environ.get("SPARK_ARROW_BATCH_SIZE", 10000))
 SPARK_LOG_LEVEL = os.environ.get(
     "SPARK_LOG_LEVEL", "ERROR"
 )  # ALL, DEBUG, ERROR, FATAL, INFO, WARN
@@ -84,8 +128,18 @@ SPARK_EXTRA_AWS_JARS = [
 ]
 
 
-def _add_derby_metastore_config(hadoop_conf):
-    """ Returns a new hadoop_conf dict with added metastore params """
+def _get_metastore_type():
+    """Return the normalized metastore type, e.g. 'DERBYINMEMORY' for 'Derby-In-Memory'."""
+    return METASTORE_TYPE.upper().replace("-", "").replace("_", "").replace(" ", "")
+
+
+def _add_derby_metastore_config(hadoop_conf, in_memory=False):
+    """
+    Returns a new hadoop_conf dict with added metastore params.
+
+    If in_memory=True, the Derby database is never written to disk, which avoids
+    startup cost and lock files at the expense of losing the catalog on shutdown.
+    """
     derby_log = "/home/data/derby.log"
     derby_home = "/home/data/derby_home"
     derby_hive_metastore_dir = "/home/data/hive_metastore_db"
@@ -102,11 +156,24 @@ def _add_derby_metastore_config(hadoop_conf):
             "spark.driver.extraJavaOptions": derby_options,
             "spark.executor.extraJavaOptions": derby_options,
             "hive.metastore.warehouse.dir": f"file://{derby_hive_metastore_dir}",
-            # "javax.jdo.option.ConnectionURL": "jdbc:derby:memory:databaseName=metastore_db;create=true",
             "javax.jdo.option.ConnectionURL": "jdbc:derby:;databaseName=/home/data/metastore_db;create=true",
             "javax.jdo.option.ConnectionDriverName": "org.apache.derby.jdbc.EmbeddedDriver",
         }
     )
+    if in_memory:
+        hadoop_conf[
+            "javax.jdo.option.ConnectionURL"
+        ] = "jdbc:derby:memory:metastore_db;create=true"
+    return hadoop_conf
+
+
+def _add_in_memory_catalog_config(hadoop_conf):
+    """
+    Returns a new hadoop_conf dict using Spark's in-memory catalog (no Hive metastore).
+
+    This is the fastest to start, but table definitions are lost on shutdown.
+    """
+    hadoop_conf.update({"spark.sql.catalogImplementation": "in-memory"})
     return hadoop_conf
 
 
@@ -121,6 +188,10 @@ def _add_mysql_metastore_config(hadoop_conf):
             "javax.jdo.option.ConnectionDriverName": "com.mysql.jdbc.Driver",
             "javax.jdo.option.ConnectionUserName": "root",
             "javax.jdo.option.ConnectionPassword": "root",
+            # Reuse metastore connections rather than reconnecting for each call:
+            "datanucleus.connectionPoolingType": METASTORE_POOL_TYPE,
+            "datanucleus.connectionPool.maxPoolSize": METASTORE_POOL_SIZE,
+            "datanucleus.connectionPool.minPoolSize": 1,
         }
     )
     if METASTORE_DB_USER:
@@ -169,24 +240,44 @@ def _get_hadoop_conf():
         "spark.executor.memory": SPARK_EXECUTOR_MEMORY,
         "spark.jars.packages": "io.delta:delta-core_2.11:0.4.0",
         "spark.logConf": "true",
+        # Use table statistics (see analyze_spark_table) for join selection and order:
+        "spark.sql.cbo.enabled": "true",
+        "spark.sql.cbo.joinReorder.enabled": "true",
+        "spark.sql.statistics.histogram.enabled": "true",
         "spark.sql.warehouse.dir": SPARK_WAREHOUSE_DIR,
         "spark.ui.showConsoleProgress": "false",  # suppress updates e.g. 'Stage 2=====>'
+        "spark.sql.execution.arrow.enabled": "true",  # Arrow-backed toPandas()
+        "spark.sql.execution.arrow.fallback.enabled": "true",
+        "spark.sql.execution.arrow.maxRecordsPerBatch": SPARK_ARROW_BATCH_SIZE,
         "log4j.rootCategory": SPARK_LOG_LEVEL,
         "log4j.logger.org.apache.hive.service.server": SPARK_LOG_LEVEL,
         "log4j.logger.org.apache.spark.api.python.PythonGatewayServer": SPARK_LOG_LEVEL,
     }
+    if SPARK_SCHEDULER_MODE:
+        hadoop_conf["spark.scheduler.mode"] = SPARK_SCHEDULER_MODE
+    if SPARK_SCHEDULER_ALLOCATION_FILE:
+        hadoop_conf["spark.scheduler.allocation.file"] = SPARK_SCHEDULER_ALLOCATION_FILE
     # Add Thrift JDBC Server settings
     hadoop_conf.update(
         {
             "spark.sql.hive.thriftServer.singleSession": "true",
-            "hive.server2.thrift.port": 10000,
+            "spark.sql.thriftServer.incrementalCollect": str(
+                THRIFT_INCREMENTAL_COLLECT
+            ).lower(),
+            "spark.driver.maxResultSize": SPARK_DRIVER_MAX_RESULT_SIZE,
+            "hive.server2.thrift.port": THRIFT_PORT,
             "hive.server2.http.endpoint": "cliservice",
             "log4j.logger.org.apache.spark.sql.hive.thriftserver": SPARK_LOG_LEVEL,
         }
     )
     hadoop_conf = _add_aws_creds_config(hadoop_conf)
-    if METASTORE_TYPE.upper() == "MYSQL":
+    metastore_type = _get_metastore_type()
+    if metastore_type == "MYSQL":
         hadoop_conf = _add_mysql_metastore_config(hadoop_conf)
+    elif metastore_type == "INMEMORY":
+        hadoop_conf = _add_in_memory_catalog_config(hadoop_conf)
+    elif metastore_type in ["DERBYINMEMORY", "DERBYMEMORY"]:
+        hadoop_conf = _add_derby_metastore_config(hadoop_conf, in_memory=True)
     else:
         hadoop_conf = _add_derby_metastore_config(hadoop_conf)
     return hadoop_conf
@@ -198,6 +289,18 @@ spark = None
 sc = None
 thrift = None
 _spark_container = None
+_diagnostics_executor = None
+_diagnostics_futures = []
+_udf_manifest = {}  # Lazy-loadable UDF names mapped to their source files
+_udf_modules = {}  # Imported UDF modules, by source file path
+_registered_udfs = set()
+_query_cache = OrderedDict()  # Cache key -> (persisted df, size in bytes, source tables)
+_query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_query_cache_lock = threading.RLock()  # Shared with build and diagnostics threads
+_table_versions = {}  # Table name -> number of times the table was (re)created
+_partition_inference_lock = threading.Lock()  # Guards the session-wide inference conf
+_delta_views = {}  # Delta table name -> name of the temp view which exposes it to SQL
+_spark_metrics_records = []
 
 
 @logged("starting Spark container '{spark_image}' with args: with_jupyter={with_jupyter}")
@@ -227,6 +330,9 @@ def _init_spark_container(spark_image=DOCKER_SPARK_IMAGE, with_jupyter=False):
         env.append(f"AWS_ACCESS_KEY_ID={os.environ['AWS_ACCESS_KEY_ID']}")
     if "AWS_SECRET_ACCESS_KEY" in os.environ:
         env.append(f"AWS_SECRET_ACCESS_KEY={os.environ['AWS_SECRET_ACCESS_KEY']}")
+    import docker
+    import dock_r
+
     docker_client = docker.from_env()  # WSL1
     # docker_client = docker.DockerClient(base_url="npipe:////./pipe/docker_wsl")  # WSL2
     try:
@@ -296,6 +402,7 @@ def _destroy_spark_container():
 def _init_spark(dockerized=False, with_jupyter=False, daemon=False):
     """Return an initialized spark object"""
     global spark, sc, thrift
+    from pyspark.sql import SparkSession
 
     if dockerized:
         container = _init_spark_container(with_jupyter=with_jupyter)
@@ -319,6 +426,9 @@ def _init_spark(dockerized=False, with_jupyter=False, daemon=False):
 def _init_local_spark():
     """Return an initialized local spark object"""
     global spark, sc, thrift
+    from py4j.java_gateway import java_import
+    from pyspark import SparkConf
+    from pyspark.sql import SparkSession
 
     # context = SparkContext(conf=conf)
     for folder in [SPARK_WAREHOUSE_DIR]:
@@ -330,14 +440,17 @@ def _init_local_spark():
         for k, v in hadoop_conf.items():
             fn(k, v)
     os.environ["PYSPARK_PYTHON"] = sys.executable
+    # Map each python thread to its own JVM thread, so per-thread properties such as
+    # scheduler pools and job groups are honored. Only Spark 3.0+ reads this setting;
+    # on Spark 2.4 these properties are not reliably scoped to a python thread.
+    os.environ.setdefault("PYSPARK_PIN_THREAD", "true")
     with logged_block("creating spark session"):
-        spark = (
-            SparkSession.builder.config(conf=conf)
-            .master("local")
-            .appName("Python Spark")
-            .enableHiveSupport()
-            .getOrCreate()
+        builder = (
+            SparkSession.builder.config(conf=conf).master("local").appName("Python Spark")
         )
+        if _get_metastore_type() != "INMEMORY":
+            builder = builder.enableHiveSupport()
+        spark = builder.getOrCreate()
         sc = spark.sparkContext
         # Set the property for the driver. Doesn't work using the same syntax
         # as the executor because the jvm has already been created.
@@ -351,16 +464,84 @@ def _init_local_spark():
             spark_hive = sc._gateway.jvm.org.apache.spark.sql.hive
             thrift_class = spark_hive.thriftserver.HiveThriftServer2
             thrift = thrift_class.startWithContext(spark._jwrapped)
-        logging.info("Sleeping while waiting for Thrift Server...")
-        time.sleep(1)
+        with logged_block(f"waiting for Thrift server on port {THRIFT_PORT}"):
+            if not _wait_for_port(THRIFT_PORT, timeout=THRIFT_STARTUP_TIMEOUT):
+                logging.warning(
+                    f"Thrift server did not accept connections on port {THRIFT_PORT} "
+                    f"within {THRIFT_STARTUP_TIMEOUT} seconds."
+                )
     spark.sparkContext.setLogLevel(SPARK_LOG_LEVEL)
     _print_conf_debug(sc)
     if ENV_VAR_SPARK_UDF_MODULE in os.environ:
-        add_udf_module(os.environ.get(ENV_VAR_SPARK_UDF_MODULE))
+        add_udf_module(os.environ.get(ENV_VAR_SPARK_UDF_MODULE), lazy=SPARK_UDF_LAZY_LOAD)
     else:
         logging.info("Skipping loading UDFs (env variable not set)")
     for jar_path in SPARK_EXTRA_AWS_JARS:
         sc.addPyFile(jar_path)
+    register_delta_tables()
+
+
+def _wait_for_port(port, host="localhost", timeout=60, interval=0.25):
+    """Return True as soon as host:port accepts TCP connections, or False on timeout."""
+    import socket
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=interval * 4):
+                return True
+        except OSError:
+            time.sleep(interval)
+    return False
+
+
+def get_thrift_query_metrics():
+    """
+    Return a list of dicts describing each query run through the Thrift JDBC server,
+    including its statement, state, user, and latency in milliseconds.
+    """
+    if not thrift:
+        return []
+    try:
+        jvm = sc._gateway.jvm
+        listener = jvm.org.apache.spark.sql.hive.thriftserver.HiveThriftServer2.listener()
+        executions = jvm.scala.collection.JavaConverters.seqAsJavaListConverter(
+            listener.getExecutionList()
+        ).asJava()
+    except Exception as ex:
+        logging.warning(f"Could not read Thrift server query metrics. {ex}")
+        return []
+    metrics = []
+    for execution in executions:
+        start, finish = execution.startTimestamp(), execution.finishTimestamp()
+        metrics.append(
+            {
+                "statement": execution.statement(),
+                "state": str(execution.state()),
+                "user": execution.userName(),
+                "start_timestamp": start,
+                "latency_ms": (finish - start) if finish else None,
+            }
+        )
+    return metrics
+
+
+def log_thrift_query_latency():
+    """Log latency percentiles for completed Thrift queries and return them as a dict."""
+    latencies = sorted(
+        m["latency_ms"] for m in get_thrift_query_metrics() if m["latency_ms"] is not None
+    )
+    if not latencies:
+        logging.info("No completed Thrift queries to report.")
+        return {}
+    summary = {
+        "queries": len(latencies),
+        "p50_ms": latencies[int(len(latencies) * 0.50)],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max_ms": latencies[-1],
+    }
+    logging.info(f"Thrift query latency: {summary}")
+    return summary
 
 
 @logged("importing from dynamic python file '{absolute_file_path}'")
@@ -374,12 +555,169 @@ def path_import(absolute_file_path):
     return module
 
 
+def _is_vectorized_function(func):
+    """
+    Return True if the function is type-hinted to accept and return pandas Series,
+    e.g. `def times_ten(value: pd.Series) -> pd.Series:`
+    """
+    import inspect
+
+    def _is_series_hint(hint):
+        if isinstance(hint, str):
+            return hint in ["pd.Series", "pandas.Series", "Series"]
+        return getattr(hint, "__name__", None) == "Series" and "pandas" in getattr(
+            hint, "__module__", ""
+        )
+
+    try:
+        sig = inspect.signature(func)
+    except (TypeError, ValueError):
+        return False
+    return (
+        len(sig.parameters) > 0
+        and _is_series_hint(sig.return_annotation)
+        and all(_is_series_hint(p.annotation) for p in sig.parameters.values())
+    )
+
+
+def _register_udf(func_name, func):
+    """
+    Register a single UDF with spark, using Arrow-batched (pandas) UDFs where possible.
+
+    - Functions already wrapped with @pandas_udf are registered as-is.
+    - Functions wrapped with @udf keep their declared return type, and are promoted to
+      pandas UDFs if the underlying function is type-hinted for pandas Series.
+    - Undecorated functions type-hinted for pandas Series are registered as pandas
+      UDFs returning SPARK_UDF_DEFAULT_RETURN_TYPE. All others are registered as
+      row-at-a-time UDFs.
+    """
+    from pyspark.rdd import PythonEvalType
+    from pyspark.sql.functions import pandas_udf
+
+    eval_type = getattr(func, "evalType", None)
+    if eval_type is not None and eval_type != PythonEvalType.SQL_BATCHED_UDF:
+        logging.info(f"Registering pandas UDF '{func_name}' ({func.returnType})")
+    elif eval_type is not None and _is_vectorized_function(func.func):
+        logging.info(f"Registering @udf '{func_name}' as a pandas UDF ({func.returnType})")
+        func = pandas_udf(func.func, func.returnType)
+    elif eval_type is not None:
+        logging.info(f"Registering UDF '{func_name}' ({func.returnType})")
+    elif _is_vectorized_function(func):
+        logging.info(
+            f"Registering type-hinted function '{func_name}' as a pandas UDF "
+            f"({SPARK_UDF_DEFAULT_RETURN_TYPE})"
+        )
+        func = pandas_udf(func, SPARK_UDF_DEFAULT_RETURN_TYPE)
+    else:
+        logging.info(f"Registering UDF '{func_name}':\n{func.__dict__}")
+    spark.udf.register(func_name, func)
+
+
+def _get_file_udf_names(file_path):
+    """Return the names of public functions in a python file, without importing it."""
+    import ast
+
+    tree = ast.parse(Path(file_path).read_bytes(), filename=file_path)
+    return [
+        node.name
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        and node.name[:1] != "_"
+        and node.name not in _UDF_SKIP_NAMES
+    ]
+
+
+@logged(
+    "building UDF manifest for '{module_dir}'",
+    success_detail="{len(result)} UDFs found",
+)
+def get_udf_manifest(module_dir, use_cache=True):
+    """
+    Return a dictionary of UDF names to the python files which define them.
+
+    Files are parsed rather than imported. The result is cached in the module directory
+    (as '.udf_manifest.json') keyed by file hashes, so only new or changed files are
+    re-parsed on subsequent calls.
+    """
+    module_dir = os.path.realpath(module_dir)
+    manifest_path = os.path.join(module_dir, UDF_MANIFEST_FILE_NAME)
+    cached_files = {}
+    if use_cache and os.path.exists(manifest_path):
+        try:
+            cached_files = json.loads(Path(manifest_path).read_text())["files"]
+        except Exception as ex:
+            logging.warning(f"Ignoring unreadable UDF manifest '{manifest_path}'. {ex}")
+    manifest_files = {}
+    for file in uio.list_files(module_dir):
+        if file.endswith(".py"):
+            file_hash = hashlib.md5(Path(file).read_bytes()).hexdigest()
+            cached = cached_files.get(file, {})
+            if cached.get("md5") == file_hash:
+                manifest_files[file] = cached
+            else:
+                logging.debug(f"Parsing UDF file '{file}' (new or changed)...")
+                manifest_files[file] = {
+                    "md5": file_hash,
+                    "udfs": _get_file_udf_names(file),
+                }
+    if use_cache and manifest_files != cached_files:
+        try:
+            Path(manifest_path).write_text(
+                json.dumps({"files": manifest_files}, indent=2)
+            )
+        except Exception as ex:
+            logging.warning(f"Could not save UDF manifest '{manifest_path}'. {ex}")
+    return {
+        udf_name: file
+        for file, file_info in manifest_files.items()
+        for udf_name in file_info["udfs"]
+    }
+
+
+def register_udfs(udf_names):
+    """Import and register the named UDFs from the lazy-loaded UDF manifest."""
+    for udf_name in _to_list(udf_names):
+        if udf_name in _registered_udfs:
+            continue
+        if udf_name not in _udf_manifest:
+            raise ValueError(f"UDF '{udf_name}' not found in the UDF manifest.")
+        file = _udf_manifest[udf_name]
+        if file not in _udf_modules:
+            _udf_modules[file] = path_import(file)
+        _register_udf(udf_name, getattr(_udf_modules[file], udf_name))
+        _registered_udfs.add(udf_name)
+
+
+def register_udfs_for_sql(sql):
+    """Register any not-yet-registered UDFs from the manifest which sql references."""
+    if not _udf_manifest:
+        return []
+    called_names = set(
+        name.lower() for name in re.findall(r"([A-Za-z_][A-Za-z0-9_]*)\s*\(", sql)
+    )
+    udf_names = [
+        udf_name
+        for udf_name in _udf_manifest
+        if udf_name.lower() in called_names and udf_name not in _registered_udfs
+    ]
+    register_udfs(udf_names)
+    return udf_names
+
+
 @logged("loading UDFs from module directory '{module_dir}'")
-def add_udf_module(module_dir=None):
+def add_udf_module(module_dir=None, arrow_batch_size=None, lazy=False):
     """
     Add a package from module_dir (or zip file) and register any udfs within the package
     The module must contain a '__init__.py' file and functions to be imported should be
-    annotated using the @udf() decorator.
+    annotated using the @udf() or @pandas_udf() decorators, or type-hinted to accept
+    and return pandas Series (which registers them as vectorized, Arrow-batched UDFs).
+    If provided, arrow_batch_size sets the max records per Arrow batch sent to pandas UDFs.
+    If lazy=True, only a manifest of UDFs is built and each UDF is imported and
+    registered on first use, from queries run through this module (for instance
+    create_spark_sql_table()) or register_udfs_for_sql(). Queries sent directly to
+    spark.sql() must call register_udfs_for_sql() first. Since queries from JDBC
+    clients cannot trigger registration, lazy mode is ignored when ENABLE_SQL_JDBC
+    is set.
     # https://stackoverflow.com/questions/47558704/python-dynamic-import-methods-from-file
     """
     global sc
@@ -393,16 +731,33 @@ def add_udf_module(module_dir=None):
     #     sys.path.append(module_root)
     if not os.path.isdir(module_dir):
         raise ValueError(f"Folder '{module_dir}' does not exist.")
+    if arrow_batch_size:
+        spark.conf.set(
+            "spark.sql.execution.arrow.maxRecordsPerBatch", int(arrow_batch_size)
+        )
+    if lazy and ENABLE_SQL_JDBC:
+        logging.warning(
+            "Registering all UDFs up front: lazy UDF loading is not supported when "
+            "serving JDBC clients (ENABLE_SQL_JDBC is set)."
+        )
+        lazy = False
+    if lazy:
+        _udf_manifest.update(get_udf_manifest(module_dir))
+        logging.info(
+            f"Deferring registration of {len(_udf_manifest)} UDFs until first use."
+        )
+        return
     for file in uio.list_files(module_dir):
         if file.endswith(".py"):
             module = path_import(file)
+            _udf_modules[file] = module
             for member in getmembers(module):
                 if isfunction(member[1]):
                     logging.info(f"Found module function: {member}")
                     func_name, func = member[0], member[1]
-                    if func_name[:1] != "_" and func_name != "udf":
-                        logging.info(f"Registering UDF '{func_name}':\n{func.__dict__}")
-                        spark.udf.register(func_name, func)
+                    if func_name[:1] != "_" and func_name not in _UDF_SKIP_NAMES:
+                        _register_udf(func_name, func)
+                        _registered_udfs.add(func_name)
                 # else:
                 #     logging.info(f"Found module entity: {member}")
     # sc.addPyFile(jar_path)
@@ -458,13 +813,319 @@ def _get_printable_context(context: dict = None, as_str=True):
 
 def _print_conf_debug(sc):
     """ Print all spark and hadoop config settings """
-    logging.debug(
-        "SparkSession 'spark' and SparkContext 'sc' initialized with settings:\n"
-        f"{_get_printable_context(dict(sc._conf.getAll()))}"
+    _run_diagnostic(
+        lambda: logging.debug(
+            "SparkSession 'spark' and SparkContext 'sc' initialized with settings:\n"
+            f"{_get_printable_context(dict(sc._conf.getAll()))}"
+        ),
+        log_level=DEBUG,
+        background=False,
     )
 
 
+_LOG_FN_LEVELS = {
+    "debug": DEBUG,
+    "info": INFO,
+    "warning": WARNING,
+    "warn": WARNING,
+    "error": ERROR,
+    "exception": ERROR,
+    "critical": CRITICAL,
+}
+
+
+def _get_log_fn_level(log_fn):
+    """Return the log level of a logger method such as 'logging.debug', or None."""
+    return _LOG_FN_LEVELS.get(getattr(log_fn, "__name__", None))
+
+
+def _is_log_enabled(log_level=None, log_fn=None):
+    """
+    Return False only if the log output would be discarded.
+
+    Functions other than logger methods (e.g. `print`) are always considered enabled.
+    """
+    logger = getattr(log_fn, "__self__", logging) if log_fn else logging
+    log_level = log_level or _get_log_fn_level(log_fn)
+    if log_level is None or not hasattr(logger, "isEnabledFor"):
+        return True
+    return logger.isEnabledFor(log_level)
+
+
+def _run_diagnostic(diagnostic_fn, log_level=None, log_fn=None, background=None):
+    """
+    Run a diagnostic function (samples, audits, config dumps) only if its output will
+    actually be logged. If background is True (default: SPARK_DIAGNOSTICS_IN_BACKGROUND),
+    the diagnostic is run on a background thread and a future is returned.
+    """
+    global _diagnostics_executor
+
+    if not _is_log_enabled(log_level=log_level, log_fn=log_fn):
+        return None
+    if background is None:
+        background = SPARK_DIAGNOSTICS_IN_BACKGROUND
+    if not background:
+        return diagnostic_fn()
+
+    def _logged_diagnostic():
+        try:
+            return diagnostic_fn()
+        except Exception as ex:
+            logging.warning(f"Background diagnostic failed. {ex}")
+
+    if not _diagnostics_executor:
+        _diagnostics_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="spark-diagnostics"
+        )
+    future = _diagnostics_executor.submit(_logged_diagnostic)
+    _diagnostics_futures.append(future)
+    return future
+
+
+def wait_for_diagnostics():
+    """Block until all background diagnostics (samples, audits, etc.) are complete."""
+    while _diagnostics_futures:
+        _diagnostics_futures.pop(0).result()
+
+
+def enable_query_cache(enabled=True, max_mb=None, storage_level=None):
+    """
+    Enable (or disable) caching of query results run through the sparkutils helpers.
+
+    Results are persisted at storage_level (e.g. 'MEMORY_AND_DISK', 'DISK_ONLY') and the
+    least-recently-used results are evicted once max_mb is exceeded. Cached results are
+    invalidated when a source table is recreated with the sparkutils table functions.
+    """
+    global SPARK_QUERY_CACHE_ENABLED, SPARK_QUERY_CACHE_MAX_MB
+    global SPARK_QUERY_CACHE_STORAGE_LEVEL
+
+    SPARK_QUERY_CACHE_ENABLED = enabled
+    SPARK_QUERY_CACHE_MAX_MB = int(max_mb or SPARK_QUERY_CACHE_MAX_MB)
+    SPARK_QUERY_CACHE_STORAGE_LEVEL = storage_level or SPARK_QUERY_CACHE_STORAGE_LEVEL
+    if not enabled:
+        clear_query_cache()
+
+
+def clear_query_cache():
+    """Unpersist and remove all cached query results."""
+    with _query_cache_lock:
+        while _query_cache:
+            _, (df, _, _) = _query_cache.popitem(last=False)
+            df.unpersist()
+
+
+def get_query_cache_stats():
+    """Return a dictionary of query cache hits, misses, evictions, entries, and size."""
+    with _query_cache_lock:
+        return dict(
+            _query_cache_stats,
+            entries=len(_query_cache),
+            size_mb=round(sum(v[1] for v in _query_cache.values()) / 1024 / 1024, 1),
+        )
+
+
+def _normalize_sql(sql):
+    """Return sql with whitespace collapsed and any trailing semicolon removed."""
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+def _get_referenced_tables(sql):
+    """Return the (lower-case) names of tables referenced after FROM or JOIN in sql."""
+    table_names = re.findall(
+        r"\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_.]*)", sql, flags=re.IGNORECASE
+    )
+    return sorted(set(name.lower() for name in table_names))
+
+
+def _get_query_cache_key(sql, source_tables):
+    """Return a cache key from the normalized sql and the versions of its source tables."""
+    table_versions = [[t, _table_versions.get(t, 0)] for t in source_tables]
+    key_text = json.dumps([_normalize_sql(sql), table_versions])
+    return hashlib.md5(key_text.encode("utf-8")).hexdigest()
+
+
+def _estimate_df_bytes(df):
+    """Return the optimizer's size estimate for df, or None if not available."""
+    try:
+        return int(str(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes()))
+    except Exception as ex:
+        logging.debug(f"Could not estimate dataframe size. {ex}")
+        return None
+
+
+def _evict_query_cache(max_bytes):
+    """Unpersist least-recently-used results until the cache fits within max_bytes."""
+    while _query_cache and sum(v[1] for v in _query_cache.values()) > max_bytes:
+        key, (df, size, _) = _query_cache.popitem(last=False)
+        logging.debug(f"Evicting cached query result {key} ({size:,.0f} bytes)")
+        df.unpersist()
+        _query_cache_stats["evictions"] += 1
+
+
+def _invalidate_table(table_name):
+    """Bump the table's version and drop any cached results which read from it."""
+    table_name = table_name.lower()
+    with _query_cache_lock:
+        _table_versions[table_name] = _table_versions.get(table_name, 0) + 1
+        for key, (df, _, source_tables) in list(_query_cache.items()):
+            if table_name in source_tables:
+                logging.debug(f"Invalidating cached query result {key} ('{table_name}')")
+                del _query_cache[key]
+                df.unpersist()
+
+
+def _run_sql(sql):
+    """Return the result of spark.sql(sql), served from the query cache if enabled."""
+    register_udfs_for_sql(sql)
+    if not SPARK_QUERY_CACHE_ENABLED:
+        return spark.sql(sql)
+    from pyspark import StorageLevel
+
+    source_tables = _get_referenced_tables(sql)
+    with _query_cache_lock:
+        key = _get_query_cache_key(sql, source_tables)
+        if key in _query_cache:
+            _query_cache.move_to_end(key)
+            _query_cache_stats["hits"] += 1
+            return _query_cache[key][0]
+        _query_cache_stats["misses"] += 1
+    df = spark.sql(sql)
+    size = _estimate_df_bytes(df)
+    max_bytes = SPARK_QUERY_CACHE_MAX_MB * 1024 * 1024
+    if size is None or size > max_bytes:
+        logging.debug("Skipping query cache for result of unknown or excessive size.")
+        return df
+    df = df.persist(getattr(StorageLevel, SPARK_QUERY_CACHE_STORAGE_LEVEL))
+    with _query_cache_lock:
+        _query_cache[key] = (df, size, source_tables)
+        _evict_query_cache(max_bytes)
+    return df
+
+
+def _get_spark_api_json(api_path):
+    """Return the JSON result of a call to the Spark UI's REST API for this app."""
+    from urllib.request import urlopen
+
+    url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/{api_path}"
+    with urlopen(url, timeout=10) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def _get_job_group_metrics(job_group):
+    """Return a dictionary of aggregated job, stage, and task metrics for a job group."""
+    tracker = sc.statusTracker()
+    job_ids = tracker.getJobIdsForGroup(job_group)
+    stage_ids = set()
+    for job_id in job_ids:
+        job_info = tracker.getJobInfo(job_id)
+        if job_info:
+            stage_ids.update(job_info.stageIds)
+    metrics = {
+        "jobs": len(job_ids),
+        "stages": len(stage_ids),
+        "tasks": 0,
+        "input_bytes": 0,
+        "input_records": 0,
+        "output_bytes": 0,
+        "output_records": 0,
+        "shuffle_read_bytes": 0,
+        "shuffle_write_bytes": 0,
+        "memory_spilled_bytes": 0,
+        "disk_spilled_bytes": 0,
+        "max_task_skew": None,  # Max ratio of max/median task time, across stages
+        "max_task_skew_stage": None,
+    }
+    stage_metrics_map = {
+        "tasks": "numCompleteTasks",
+        "input_bytes": "inputBytes",
+        "input_records": "inputRecords",
+        "output_bytes": "outputBytes",
+        "output_records": "outputRecords",
+        "shuffle_read_bytes": "shuffleReadBytes",
+        "shuffle_write_bytes": "shuffleWriteBytes",
+        "memory_spilled_bytes": "memoryBytesSpilled",
+        "disk_spilled_bytes": "diskBytesSpilled",
+    }
+    for stage_id in sorted(stage_ids):
+        for attempt in _get_spark_api_json(f"stages/{stage_id}"):
+            for metric_name, api_name in stage_metrics_map.items():
+                metrics[metric_name] += attempt.get(api_name, 0)
+            task_summary = _get_spark_api_json(
+                f"stages/{stage_id}/{attempt['attemptId']}/taskSummary"
+                "?quantiles=0.5,1.0"
+            )
+            median_time, max_time = task_summary["executorRunTime"]
+            if median_time:
+                skew = round(max_time / median_time, 2)
+                if skew > (metrics["max_task_skew"] or 0):
+                    metrics["max_task_skew"] = skew
+                    metrics["max_task_skew_stage"] = stage_id
+    return metrics
+
+
+def get_spark_metrics():
+    """Return the list of structured metrics records captured for table operations."""
+    return list(_spark_metrics_records)
+
+
+@contextmanager
+def _captured_spark_metrics(operation, table_name):
+    """
+    Run the Spark jobs inside the with block in their own job group, and then record
+    job/stage metrics for the group as a structured record.
+
+    Records are logged, returned by get_spark_metrics(), and (if SPARK_METRICS_LOG_FILE
+    is set) appended as JSON lines to that file.
+    """
+    if not SPARK_METRICS_ENABLED or not sc:
+        yield
+        return
+    job_group = f"{operation}:{table_name}:{uuid.uuid4().hex[:8]}"
+    prev_group = sc.getLocalProperty("spark.jobGroup.id")
+    prev_desc = sc.getLocalProperty("spark.job.description")
+    sc.setLocalProperty("spark.jobGroup.id", job_group)
+    sc.setLocalProperty("spark.job.description", f"{operation} '{table_name}'")
+    start = time.time()
+    succeeded = False
+    try:
+        yield
+        succeeded = True
+    finally:
+        sc.setLocalProperty("spark.jobGroup.id", prev_group)
+        sc.setLocalProperty("spark.job.description", prev_desc)
+        record = {
+            "operation": operation,
+            "table_name": table_name,
+            "succeeded": succeeded,
+            "duration_seconds": round(time.time() - start, 3),
+        }
+        try:
+            record.update(_get_job_group_metrics(job_group))
+        except Exception as ex:
+            logging.warning(f"Could not capture Spark metrics for '{table_name}'. {ex}")
+        _spark_metrics_records.append(record)
+        logging.info(f"Spark metrics for '{table_name}': {json.dumps(record)}")
+        if SPARK_METRICS_LOG_FILE:
+            with open(SPARK_METRICS_LOG_FILE, "a", encoding="utf-8") as metrics_file:
+                metrics_file.write(json.dumps(record) + "\n")
+
+
+def _spark_metrics(operation):
+    """Decorator to capture Spark metrics for a function whose first arg is table_name."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapped_fn(table_name, *args, **kwargs):
+            with _captured_spark_metrics(operation, table_name):
+                return fn(table_name, *args, **kwargs)
+
+        return wrapped_fn
+
+    return decorator
+
+
 # Spark Helper Function:
+@_spark_metrics("create_spark_sql_table")
 @logged("creating table '{table_name}'", success_detail="{result.count():,.0f} rows")
 def create_spark_sql_table(
     table_name,
@@ -473,20 +1134,87 @@ def create_spark_sql_table(
     print_n_rows=None,
     run_audit=True,
     schema_only=False,
+    bucket_by=None,
+    num_buckets=None,
+    sort_by=None,
+    distribute_by=None,
+    compute_stats=None,
+    stats_columns=None,
+    table_format=None,
+    write_mode="overwrite",
+    key_cols=None,
+    partition_by=None,
 ):
+    """
+    Create (or replace) a parquet table from the results of sql.
+
+    To avoid shuffles in later joins and aggregations on the same keys, pass bucket_by
+    (a list or comma-separated string of columns) and optionally num_buckets (default:
+    SPARK_DEFAULT_NUM_BUCKETS) and sort_by. Without bucketing, distribute_by and sort_by
+    control the partitioning and sort order of the files written. If partition_by is
+    provided, the table is partitioned into folders by those columns.
+
+    If compute_stats is True (default: SPARK_COMPUTE_TABLE_STATS) or stats_columns are
+    provided, table statistics are computed for the cost-based optimizer after creation.
+
+    If table_format='delta' (default: SPARK_TABLE_FORMAT), the results are instead
+    written to a Delta table using write_mode, key_cols and partition_by. Bucketing and
+    statistics are not supported for Delta tables. See create_spark_table() for details.
+    """
+    register_udfs_for_sql(sql)
+    if (table_format or SPARK_TABLE_FORMAT).lower() == "delta":
+        create_spark_table(
+            spark.sql(sql),
+            table_name,
+            print_n_rows=print_n_rows,
+            run_audit=run_audit,
+            schema_only=schema_only,
+            bucket_by=bucket_by,
+            num_buckets=num_buckets,
+            sort_by=sort_by,
+            distribute_by=distribute_by,
+            compute_stats=compute_stats,
+            stats_columns=stats_columns,
+            table_format="delta",
+            write_mode=write_mode,
+            key_cols=key_cols,
+            partition_by=partition_by,
+        )
+        return get_delta_table_df(table_name)
+    if write_mode != "overwrite":
+        raise ValueError(
+            f"Unsupported write_mode '{write_mode}' for parquet tables. "
+            "Use table_format='delta' for incremental writes."
+        )
+    bucket_cols, sort_cols = _to_list(bucket_by), _to_list(sort_by)
+    distribute_cols, partition_cols = _to_list(distribute_by), _to_list(partition_by)
+    if bucket_cols and distribute_cols:
+        raise ValueError("Arguments 'bucket_by' and 'distribute_by' can't be combined.")
     spark.sql(f"DROP TABLE IF EXISTS {table_name}")
-    distribution_clause = ""
-    for col in ["AccountId", "OpportunityId"]:
-        if SUPPORT_CLUSTER_BY and not distribution_clause and col in sql:
-            distribution_clause = "\n    DISTRIBUTE BY {col}"
+    layout_clause = ""
+    if partition_cols:
+        layout_clause = f"PARTITIONED BY ({', '.join(partition_cols)})\n    "
+    if bucket_cols:
+        layout_clause += f"CLUSTERED BY ({', '.join(bucket_cols)})"
+        if sort_cols:
+            layout_clause += f" SORTED BY ({', '.join(sort_cols)})"
+        layout_clause += f" INTO {int(num_buckets or SPARK_DEFAULT_NUM_BUCKETS)} BUCKETS"
+    elif distribute_cols or sort_cols:
+        sql = f"SELECT * FROM (\n{sql.rstrip().rstrip(';')}\n) AS __source"
+        if distribute_cols:
+            sql += f"\nDISTRIBUTE BY {', '.join(distribute_cols)}"
+        if sort_cols:
+            sql += f"\nSORT BY {', '.join(sort_cols)}"
     sql_command = f"""
     CREATE TABLE {table_name}
     USING PARQUET
+    {layout_clause}
     AS
     {sql}
-    {distribution_clause}
     """
     spark.sql(sql_command)
+    _invalidate_table(table_name)
+    _analyze_if_requested(table_name, compute_stats, stats_columns)
     df = spark.sql(f"SELECT * FROM {table_name}")
     if print_n_rows:
         sample_spark_table(table_name, n=print_n_rows)
@@ -495,8 +1223,141 @@ def create_spark_sql_table(
     return df
 
 
-def audit_spark_table_keys(table_name, key_col_suffix="Id", raise_error=False):
-    df = spark.sql(f"SELECT * FROM {table_name}")
+@logged("computing statistics for table '{table_name}'")
+def analyze_spark_table(table_name, columns=None):
+    """
+    Compute table-level statistics (size and row count) for the cost-based optimizer,
+    plus column-level statistics (distinct counts, min/max, nulls, histograms) for any
+    columns provided.
+    """
+    spark.sql(f"ANALYZE TABLE {table_name} COMPUTE STATISTICS")
+    stats_cols = _to_list(columns)
+    if stats_cols:
+        spark.sql(
+            f"ANALYZE TABLE {table_name} COMPUTE STATISTICS "
+            f"FOR COLUMNS {', '.join(stats_cols)}"
+        )
+
+
+def _analyze_if_requested(table_name, compute_stats=None, stats_columns=None):
+    if compute_stats is None:
+        compute_stats = SPARK_COMPUTE_TABLE_STATS or bool(stats_columns)
+    if compute_stats:
+        analyze_spark_table(table_name, columns=stats_columns)
+
+
+def get_table_dependencies(table_sqls):
+    """
+    Return a dictionary of each table name to the set of other tables in table_sqls
+    which its SQL reads from. Accepts a dict or a list of (table_name, sql) pairs.
+    """
+    table_sqls = dict(table_sqls)
+    batch_tables = {name.lower(): name for name in table_sqls}
+    return {
+        table_name: set(
+            batch_tables[ref]
+            for ref in _get_referenced_tables(sql)
+            if ref in batch_tables and ref != table_name.lower()
+        )
+        for table_name, sql in table_sqls.items()
+    }
+
+
+def _create_spark_sql_table_in_pool(table_name, sql, pool_name, **kwargs):
+    """Build the table, submitting its Spark jobs to the named scheduler pool."""
+    sc.setLocalProperty("spark.scheduler.pool", pool_name)
+    try:
+        return create_spark_sql_table(table_name, sql, **kwargs)
+    finally:
+        sc.setLocalProperty("spark.scheduler.pool", None)
+
+
+@logged("creating {len(table_sqls)} tables", success_detail="max_parallel={max_parallel}")
+def create_spark_sql_tables(
+    table_sqls, max_parallel=SPARK_MAX_PARALLEL_BUILDS, pool_prefix="build", **kwargs
+):
+    """
+    Create many tables from a dict or list of (table_name, sql) pairs, building
+    independent tables in parallel.
+
+    Dependencies are detected from the tables referenced in each SQL statement, and each
+    table is only started after the tables it reads from are complete. At most
+    max_parallel tables are built at a time. Additional keyword args are passed to
+    create_spark_sql_table().
+
+    Each build also requests its own scheduler pool (named '{pool_prefix}_{table_name}')
+    so that small builds are not starved by large ones. The pools only take effect with
+    SPARK_SCHEDULER_MODE=FAIR on Spark 3.0+ (with PYSPARK_PIN_THREAD enabled, the
+    default for local sessions). On Spark 2.4, thread-local properties are not reliably
+    tied to the building thread, so pools and per-table Spark metrics may be mixed up
+    between concurrent builds; use max_parallel=1 where these matter.
+
+    Returns the list of table names, in order of completion.
+    """
+    table_sqls = dict(table_sqls)
+    remaining = get_table_dependencies(table_sqls)
+    completed, failures = [], {}
+    running = {}
+    with ThreadPoolExecutor(
+        max_workers=int(max_parallel), thread_name_prefix="spark-build"
+    ) as executor:
+        while remaining or running:
+            ready = [] if failures else [t for t, d in remaining.items() if not d]
+            for table_name in ready:
+                del remaining[table_name]
+                future = executor.submit(
+                    _create_spark_sql_table_in_pool,
+                    table_name,
+                    table_sqls[table_name],
+                    pool_name=f"{pool_prefix}_{table_name}",
+                    **kwargs,
+                )
+                running[future] = table_name
+            if not running:
+                if failures:
+                    break
+                raise ValueError(
+                    f"Circular table dependencies detected: {sorted(remaining)}"
+                )
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                table_name = running.pop(future)
+                if future.exception():
+                    failures[table_name] = future.exception()
+                    continue
+                completed.append(table_name)
+                for deps in remaining.values():
+                    deps.discard(table_name)
+    if failures:
+        raise RuntimeError(
+            f"Failed to build {len(failures)} table(s): {failures}. "
+            f"Not started: {sorted(remaining)}"
+        )
+    return completed
+
+
+def audit_spark_table_keys(
+    table_name, key_col_suffix="Id", raise_error=False, background=None
+):
+    """
+    Audit the key columns of a table, logging (or raising) if no unique key is found.
+
+    Unless raise_error is True, the audit is skipped if warnings are not being logged,
+    and will be run on a background thread if background=True (default is the value
+    of SPARK_DIAGNOSTICS_IN_BACKGROUND).
+    """
+    if raise_error:
+        return _audit_spark_table_keys(table_name, key_col_suffix, raise_error=True)
+    return _run_diagnostic(
+        lambda: _audit_spark_table_keys(table_name, key_col_suffix, raise_error=False),
+        log_level=WARNING,
+        background=background,
+    )
+
+
+def _audit_spark_table_keys(table_name, key_col_suffix="Id", raise_error=False):
+    sql_table_name = _get_sql_table_name(table_name)
+    df = spark.sql(f"SELECT * FROM {sql_table_name}")
     key_cols = [c for c in df.columns if key_col_suffix in c]
     if not key_cols:
         key_cols.append(df.columns[0])
@@ -506,9 +1367,9 @@ def audit_spark_table_keys(table_name, key_col_suffix="Id", raise_error=False):
             for c in key_cols
         ]
     )
-    sql = f"SELECT COUNT(*) AS __num_rows, {cols}\nFROM {table_name}"
+    sql = f"SELECT COUNT(*) AS __num_rows, {cols}\nFROM {sql_table_name}"
     logging.info(f"Running '{table_name}' table audit...")
-    result = spark.sql(sql).collect()[0]
+    result = _run_sql(sql).collect()[0]
     num_rows = result["__num_rows"]
     unique = []
     empty = []
@@ -534,24 +1395,69 @@ def audit_spark_table_keys(table_name, key_col_suffix="Id", raise_error=False):
         logging.info(f"Table audit successful for '{table_name}'. {result_text}")
 
 
-def sample_spark_table(table_name, n=1):
-    df = spark.sql(f"SELECT * FROM {table_name} LIMIT {n}")
-    sample_spark_df(df, n=n, name=table_name)
+def sample_spark_table(table_name, n=1, log_fn=logging.debug, background=None):
+    df = _run_sql(f"SELECT * FROM {_get_sql_table_name(table_name)} LIMIT {n}")
+    sample_spark_df(df, n=n, name=table_name, log_fn=log_fn, background=background)
 
 
-def sample_spark_df(df, n=1, name=None, log_fn=logging.debug):
-    log_fn(
-        f"Spark Dataframe column list: "
-        f"{', '.join(['{dtype[0]} ({dtype[1]})' for dtype in df.dtypes])}"
-        f"'{name or 'Dataframe'}' row sample:\n{df.limit(n).toPandas().head(n)}\n"
+def sample_spark_df(df, n=1, name=None, log_fn=logging.debug, background=None):
+    """
+    Log the column list and a sample of n rows from the dataframe.
+
+    The sample (a Spark job) is only collected if log_fn's level is enabled, and is
+    run on a background thread if background=True (default is the value of
+    SPARK_DIAGNOSTICS_IN_BACKGROUND).
+    """
+    return _run_diagnostic(
+        lambda: log_fn(
+            f"Spark Dataframe column list: "
+            f"{', '.join([f'{dtype[0]} ({dtype[1]})' for dtype in df.dtypes])}\n"
+            f"'{name or 'Dataframe'}' row sample:\n{df.limit(n).toPandas().head(n)}\n"
+        ),
+        log_fn=log_fn,
+        background=background,
     )
 
 
 def create_spark_table(
-    df, table_name, print_n_rows=None, run_audit=False, schema_only=False
+    df,
+    table_name,
+    print_n_rows=None,
+    run_audit=False,
+    schema_only=False,
+    bucket_by=None,
+    num_buckets=None,
+    sort_by=None,
+    distribute_by=None,
+    compute_stats=None,
+    stats_columns=None,
+    table_format=None,
+    write_mode="overwrite",
+    key_cols=None,
+    partition_by=None,
 ):
+    """
+    Create (or replace) a table from a spark dataframe, pandas dataframe, or list.
+
+    See create_spark_sql_table() for the bucketing, distribution and statistics
+    arguments.
+
+    If table_format='delta' (default: SPARK_TABLE_FORMAT), data is written to a Delta
+    table under SPARK_DELTA_DIR and registered as a temp view (see
+    get_delta_view_name()). Bucketing and statistics are not supported for Delta
+    tables. Delta tables support these write modes:
+
+    - 'overwrite': replace all data (the default).
+    - 'append': add the new rows to the existing data.
+    - 'merge': upsert on key_cols, updating matched rows and inserting the rest.
+    - 'overwrite_partitions': replace only the partition_by partitions present in df.
+
+    For parquet tables, 'overwrite' and 'append' are supported.
+    """
     start_time = time.time()
-    if isinstance(df, pyspark.sql.DataFrame):
+    from pyspark.sql import DataFrame as SparkDataFrame
+
+    if isinstance(df, SparkDataFrame):
         logging.info(f"Creating spark table '{table_name}' from spark dataframe...")
         spark_df = df
     elif pd and isinstance(df, pd.DataFrame):
@@ -567,19 +1473,390 @@ def create_spark_table(
             f"Creating table '{table_name}' from unknown type '{type(df).__name__}"
         )
         spark_df = spark.createDataFrame(df, verifySchema=False)
-    spark_df.write.saveAsTable(table_name, mode="overwrite")
+    is_delta = (table_format or SPARK_TABLE_FORMAT).lower() == "delta"
+    supported_modes = DELTA_WRITE_MODES if is_delta else ["overwrite", "append"]
+    if write_mode not in supported_modes:
+        raise ValueError(
+            f"Unsupported write_mode '{write_mode}'. Expected one of: {supported_modes}"
+        )
+    bucket_cols, sort_cols = _to_list(bucket_by), _to_list(sort_by)
+    distribute_cols = _to_list(distribute_by)
+    if is_delta and (bucket_cols or num_buckets):
+        raise ValueError("Bucketing is not supported for Delta tables.")
+    if is_delta and (compute_stats or stats_columns):
+        raise ValueError("Table statistics are not supported for Delta tables.")
+    if distribute_cols:
+        spark_df = spark_df.repartition(*distribute_cols)
+    if sort_cols and not bucket_cols:
+        spark_df = spark_df.sortWithinPartitions(*sort_cols)
+    if is_delta:
+        _write_delta_table(spark_df, table_name, write_mode, key_cols, partition_by)
+    else:
+        writer = spark_df.write
+        if bucket_cols:
+            writer = writer.bucketBy(
+                int(num_buckets or SPARK_DEFAULT_NUM_BUCKETS), *bucket_cols
+            )
+            if sort_cols:
+                writer = writer.sortBy(*sort_cols)
+        if partition_by:
+            writer = writer.partitionBy(*_to_list(partition_by))
+        writer.saveAsTable(table_name, mode=write_mode)
+    _invalidate_table(table_name)
+    if not is_delta:
+        _analyze_if_requested(table_name, compute_stats, stats_columns)
     if print_n_rows:
         sample_spark_table(table_name, n=print_n_rows)
     if run_audit:
         audit_spark_table_keys(table_name)
 
 
+def get_delta_table_path(table_name):
+    """Return the storage path of the named Delta table."""
+    return os.path.join(SPARK_DELTA_DIR, table_name.replace(".", "/"))
+
+
+def _get_delta_table(table_name_or_path):
+    """Return a DeltaTable for the table name or path, or None if it does not exist."""
+    from delta.tables import DeltaTable
+
+    path = table_name_or_path
+    if "/" not in path:
+        path = get_delta_table_path(table_name_or_path)
+    path = _verify_path(path)
+    if not DeltaTable.isDeltaTable(spark, path):
+        return None
+    return DeltaTable.forPath(spark, path)
+
+
+def get_delta_view_name(table_name):
+    """
+    Return the name of the temp view which exposes the Delta table to SQL.
+
+    Temp views can't be qualified with a database, so the table 'raw.opps' is exposed
+    as the view 'raw__opps' (and never collides with 'staging.opps').
+    """
+    return table_name.replace(".", "__")
+
+
+def _get_sql_table_name(table_name):
+    """Return the name to use for the table in SQL: its view name if it is Delta."""
+    return _delta_views.get(table_name.lower(), table_name)
+
+
+def get_delta_table_df(table_name):
+    """Return a spark dataframe of the current version of the Delta table."""
+    path = _verify_path(get_delta_table_path(table_name))
+    return spark.read.format("delta").load(path)
+
+
+def _register_delta_table(table_name):
+    """(Re)create the view which exposes the Delta table to SQL, and return its df."""
+    view_name = get_delta_view_name(table_name)
+    df = get_delta_table_df(table_name)
+    df.createOrReplaceTempView(view_name)
+    _delta_views[table_name.lower()] = view_name
+    if view_name != table_name:
+        _invalidate_table(view_name)  # Cached queries refer to the view
+    return df
+
+
+def register_delta_tables():
+    """
+    Register a view for each Delta table found in SPARK_DELTA_DIR, named as in
+    get_delta_view_name(). Returns the table names.
+    """
+
+    def _get_folder_names(folder_path):
+        return {
+            x.rstrip("/").rsplit("/", 1)[-1]: x for x in _list_hadoop_dirs(folder_path)
+        }
+
+    # Only folders are listed, and never below a table's own folder, so startup time
+    # doesn't grow with the number of data files.
+    table_names = []
+    for name, folder in _get_folder_names(_verify_path(SPARK_DELTA_DIR)).items():
+        subfolders = _get_folder_names(folder)
+        if "_delta_log" in subfolders:
+            table_names.append(name)
+            continue
+        for table_name, table_folder in subfolders.items():  # Database folder
+            if "_delta_log" in _get_folder_names(table_folder):
+                table_names.append(f"{name}.{table_name}")
+    for table_name in sorted(table_names):
+        _register_delta_table(table_name)
+    return sorted(table_names)
+
+
+def _get_partition_predicate(spark_df, partition_cols):
+    """Return a SQL predicate matching all partitions present in spark_df."""
+    partition_values = spark_df.select(*partition_cols).distinct().collect()
+    if not partition_values:
+        return None
+    predicates = []
+    for row in partition_values:
+        conditions = []
+        for col in partition_cols:
+            value = row[col]
+            if value is None:
+                conditions.append(f"{col} IS NULL")
+            elif isinstance(value, (int, float)):
+                conditions.append(f"{col} = {value}")
+            else:
+                escaped = str(value).replace("'", "\\'")
+                conditions.append(f"{col} = '{escaped}'")
+        predicates.append(f"({' AND '.join(conditions)})")
+    return " OR ".join(predicates)
+
+
+def _write_delta_table(
+    spark_df, table_name, write_mode="overwrite", key_cols=None, partition_by=None
+):
+    """Write spark_df to the named Delta table, then register its view."""
+    path = _verify_path(get_delta_table_path(table_name))
+    partition_cols = _to_list(partition_by)
+    existing = _get_delta_table(path)
+    if write_mode == "merge" and existing:
+        join_cols = _to_list(key_cols)
+        if not join_cols:
+            raise ValueError("Argument 'key_cols' is required for write_mode='merge'.")
+        merge_condition = " AND ".join(
+            f"__target.{col} = __source.{col}" for col in join_cols
+        )
+        logging.info(
+            f"Merging into Delta table '{table_name}' on {join_cols}: '{path}'..."
+        )
+        existing.alias("__target").merge(
+            spark_df.alias("__source"), merge_condition
+        ).whenMatchedUpdateAll().whenNotMatchedInsertAll().execute()
+    else:
+        writer = spark_df.write.format("delta")
+        if write_mode == "overwrite_partitions" and existing:
+            if not partition_cols:
+                raise ValueError(
+                    "Argument 'partition_by' is required "
+                    "for write_mode='overwrite_partitions'."
+                )
+            predicate = _get_partition_predicate(spark_df, partition_cols)
+            if predicate is None:
+                logging.info(f"No partitions to overwrite in Delta table '{table_name}'.")
+                _register_delta_table(table_name)
+                return
+            writer = writer.option("replaceWhere", predicate)
+        mode = "append" if write_mode == "append" else "overwrite"
+        if mode == "overwrite" and not existing:
+            logging.debug(f"Creating new Delta table '{table_name}': '{path}'...")
+        elif mode == "overwrite" and write_mode == "overwrite":
+            writer = writer.option("overwriteSchema", "true")
+        if partition_cols:
+            writer = writer.partitionBy(*partition_cols)
+        writer.save(path, mode=mode)
+    _register_delta_table(table_name)
+
+
+@logged("compacting Delta table '{table_name}'")
+def compact_delta_table(table_name, num_files=None, target_file_mb=None):
+    """
+    Rewrite the Delta table into fewer, larger files without changing its data.
+
+    If num_files is not provided, it is calculated from the table size and
+    target_file_mb (default: SPARK_DELTA_TARGET_FILE_MB).
+    """
+    path = _verify_path(get_delta_table_path(table_name))
+    if not num_files:
+        delta_log = spark._jvm.org.apache.spark.sql.delta.DeltaLog.forTable(
+            spark._jsparkSession, path
+        )
+        size_mb = delta_log.snapshot().sizeInBytes() / (1024 * 1024)
+        num_files = max(1, int(size_mb / (target_file_mb or SPARK_DELTA_TARGET_FILE_MB)))
+    logging.info(f"Compacting Delta table '{table_name}' into {num_files} file(s)...")
+    spark.read.format("delta").load(path).repartition(num_files).write.format(
+        "delta"
+    ).option("dataChange", "false").save(path, mode="overwrite")
+    _register_delta_table(table_name)
+    _invalidate_table(table_name)
+
+
+@logged("vacuuming Delta table '{table_name}'")
+def vacuum_delta_table(table_name, retention_hours=None):
+    """
+    Delete data files no longer referenced by the Delta table and older than
+    retention_hours (default: SPARK_DELTA_RETENTION_HOURS).
+    """
+    delta_table = _get_delta_table(table_name)
+    if not delta_table:
+        raise ValueError(f"Delta table '{table_name}' does not exist.")
+    delta_table.vacuum(retention_hours or SPARK_DELTA_RETENTION_HOURS)
+
+
+def _get_table_details(table_name, partition=None):
+    """
+    Return the 'Detailed Table Information' section of DESCRIBE FORMATTED as a dict,
+    or the 'Detailed Partition Information' if partition ('key=value/...') is given.
+    """
+    sql = f"DESCRIBE FORMATTED {table_name}"
+    if partition:
+        sql += f" PARTITION ({_get_partition_spec_sql(partition)})"
+    details = {}
+    for row in spark.sql(sql).collect():
+        if row.col_name and not row.col_name.startswith("#"):
+            # Keep the first value, e.g. the partition's Location rather than the table's
+            details.setdefault(row.col_name.strip(), (row.data_type or "").strip())
+    return details
+
+
+def _get_partition_spec_sql(partition):
+    """Return the PARTITION clause contents for a 'key=value/...' partition path."""
+    from urllib.parse import unquote
+
+    conditions = []
+    for folder in partition.split("/"):
+        key, value = folder.split("=", 1)
+        escaped = unquote(value).replace("'", "\\'")
+        conditions.append(f"{key}='{escaped}'")
+    return ", ".join(conditions)
+
+
+def _get_partition_locations(table_name):
+    """
+    Return a dict of each partition ('key=value/...') of the table to its storage
+    location, according to the catalog. Unpartitioned tables return {None: location}.
+    """
+    database, _, name = table_name.rpartition(".")
+    columns = spark.catalog.listColumns(name, database or None)
+    if not any(col.isPartition for col in columns):
+        return {None: _get_table_details(table_name).get("Location")}
+    partitions = [row[0] for row in spark.sql(f"SHOW PARTITIONS {table_name}").collect()]
+    return {
+        partition: _get_table_details(table_name, partition).get("Location")
+        for partition in partitions
+    }
+
+
+def get_table_file_stats(table_name, target_file_mb=None):
+    """
+    Return a list of file size stats for each partition (or folder) of the table.
+
+    A partition is flagged as fragmented if it has more files than needed for the
+    target file size (default: SPARK_COMPACT_TARGET_FILE_MB) and its files average less
+    than half the target size.
+    """
+    target_bytes = (target_file_mb or SPARK_COMPACT_TARGET_FILE_MB) * 1024 * 1024
+    results = []
+    for partition, location in sorted(
+        _get_partition_locations(table_name).items(), key=lambda x: x[0] or ""
+    ):
+        if not location:
+            raise ValueError(f"Could not detect the storage location of '{table_name}'.")
+        sizes = [stats["size"] for stats in _list_hadoop_files(location).values()]
+        if not sizes:
+            continue
+        total_bytes = sum(sizes)
+        target_files = max(1, -(-total_bytes // target_bytes))  # Ceiling division
+        results.append(
+            {
+                "partition": partition,
+                "path": location,
+                "num_files": len(sizes),
+                "total_mb": round(total_bytes / (1024 * 1024), 2),
+                "min_file_mb": round(min(sizes) / (1024 * 1024), 2),
+                "max_file_mb": round(max(sizes) / (1024 * 1024), 2),
+                "avg_file_mb": round(total_bytes / len(sizes) / (1024 * 1024), 2),
+                "target_files": target_files,
+                "fragmented": (
+                    len(sizes) > target_files
+                    and total_bytes / len(sizes) < target_bytes / 2
+                ),
+            }
+        )
+    return results
+
+
+def _get_compacted_path(folder_path):
+    """Return a new, unique sibling folder path for the compacted copy of folder_path."""
+    parent, name = folder_path.rstrip("/").rsplit("/", 1)
+    match = re.match(r"^_(.+)\.compacted-[0-9a-f]{8}$", name)  # Compacted before
+    base_name = match.group(1) if match else name
+    # A leading underscore hides the folder from readers which list the parent folder
+    return f"{parent}/_{base_name}.compacted-{uuid.uuid4().hex[:8]}"
+
+
+def _rewrite_folder(folder_path, num_files, file_format="parquet"):
+    """Write all files in the folder into num_files in a new folder, and return its path."""
+    new_path = _get_compacted_path(folder_path)
+    spark.read.format(file_format).load(folder_path).coalesce(num_files).write.format(
+        file_format
+    ).save(new_path, mode="errorifexists")
+    return new_path
+
+
+@logged("compacting table '{table_name}'")
+def compact_spark_table(table_name, target_file_mb=None, dry_run=False):
+    """
+    Rewrite the fragmented partitions of a table into files close to target_file_mb
+    (default: SPARK_COMPACT_TARGET_FILE_MB) and return the per-partition file stats.
+
+    Each partition is written to a new folder and the catalog is then repointed to it
+    (ALTER TABLE ... SET LOCATION), so readers see either the old or the new files and
+    no files are ever renamed. The old files are deleted once all partitions have been
+    repointed. Bucketed tables are skipped, since rewriting them would break the
+    bucketing. If dry_run=True, only the stats are reported.
+    """
+    get_spark()
+    details = _get_table_details(table_name)
+    provider = details.get("Provider", "parquet").lower()
+    if details.get("Num Buckets", "-1") not in ["-1", "0"]:
+        logging.warning(f"Skipping compaction of bucketed table '{table_name}'.")
+        return []
+    if provider == "delta" or "Location" not in details:
+        logging.warning(
+            f"Skipping compaction of '{table_name}'. "
+            "Use compact_delta_table() for Delta tables."
+        )
+        return []
+    if provider not in ["parquet", "orc"]:
+        logging.warning(
+            f"Skipping compaction of '{table_name}' (unsupported format '{provider}')."
+        )
+        return []
+    stats = get_table_file_stats(table_name, target_file_mb=target_file_mb)
+    fragmented = [x for x in stats if x["fragmented"]]
+    logging.info(
+        f"Found {len(fragmented)} fragmented of {len(stats)} partition(s) "
+        f"in '{table_name}':\n"
+        + "\n".join(
+            f"  {x['partition'] or '(root)'}: {x['num_files']} files, "
+            f"{x['total_mb']}MB total, {x['avg_file_mb']}MB average"
+            for x in fragmented
+        )
+    )
+    if dry_run:
+        return stats
+    for partition_stats in fragmented:
+        new_path = _rewrite_folder(
+            partition_stats["path"], partition_stats["target_files"], provider
+        )
+        partition_clause = ""
+        if partition_stats["partition"]:
+            partition_spec = _get_partition_spec_sql(partition_stats["partition"])
+            partition_clause = f" PARTITION ({partition_spec})"
+        spark.sql(f"ALTER TABLE {table_name}{partition_clause} SET LOCATION '{new_path}'")
+    if fragmented:
+        spark.sql(f"REFRESH TABLE {table_name}")
+        _invalidate_table(table_name)
+    for partition_stats in fragmented:
+        fs, old_path = _get_hadoop_fs(partition_stats["path"])
+        fs.delete(old_path, True)
+    return stats
+
+
 def _verify_path(file_path):
     return file_path.replace(
         "s3://", SPARK_S3_PREFIX
     )  # .replace("propensity-to-buy", "propensity-to-buy-2")
 
 
+@_spark_metrics("load_to_spark_table")
 @logged("loading spark table '{table_name}'")
 def load_to_spark_table(
     table_name,
@@ -593,46 +1870,413 @@ def load_to_spark_table(
     print_n_rows=None,
     clean_col_names=False,
     schema_only=False,
+    table_format=None,
+    write_mode="overwrite",
+    key_cols=None,
+    partition_by=None,
+    incremental=False,
+    partition_filters=None,
+    partition_range=None,
+    latest_partitions=None,
+    infer_partition_types=True,
 ):
+    """
+    Load a table from an Excel file or from one or more CSV files.
+
+    Subfolders named 'key=value' (e.g. 'batch=<id>') are loaded as partition columns.
+    To list and read only some partitions, pass any of:
+
+    - partition_filters: a dict of partition keys to a value, a list of values, or a
+      function which returns True for values to be loaded.
+    - partition_range: a dict of partition keys to (min, max) tuples, inclusive. Use
+      None for an open-ended range.
+    - latest_partitions: a dict of partition keys to the number of most recent values
+      to load, e.g. {"batch": 7}.
+
+    If infer_partition_types=False, partition columns are loaded as strings. (This is a
+    session-wide setting while the files are listed, so concurrent loads through this
+    function wait for each other; other readers in the session are not protected.)
+
+    If incremental=True, a manifest of previously ingested files (with their size and
+    modified time) is kept for the table and only new or changed files are read. New
+    files are appended (or merged, with write_mode='merge'), and rows previously loaded
+    from changed files are replaced. Incremental loads require filename_column and
+    can't be combined with write_mode='overwrite_partitions'.
+    """
     start_time = time.time()
     file_path = _verify_path(file_path)
+    write_args = dict(
+        table_format=table_format,
+        write_mode=write_mode,
+        key_cols=key_cols,
+        partition_by=partition_by,
+    )
 
     if ".xlsx" in file_path.lower():
         if pd:
-            logging.debug(
-                f"Using pandas to load spark table '{table_name}' from '{file_path}'..."
-            )
-            df = pandasutils.get_pandas_df(file_path)
-            create_spark_table(df, table_name, print_n_rows=print_n_rows)
+            df = _get_excel_spark_df(file_path, table_name)
+            create_spark_table(df, table_name, print_n_rows=print_n_rows, **write_args)
         else:
             pandasutils._raise_if_missing_pandas()
     else:
+        read_paths, changed_files, file_stats = file_path, [], None
+        if partition_filters or partition_range or latest_partitions:
+            read_paths = get_partition_paths(
+                file_path, partition_filters, partition_range, latest_partitions
+            )
+            if not read_paths:
+                logging.warning(
+                    f"No partitions matched the filters in '{file_path}'. "
+                    f"Skipping load of table '{table_name}'."
+                )
+                return
+            logging.info(
+                f"Loading {len(read_paths)} matching partition(s) "
+                f"to table '{table_name}'..."
+            )
+        if incremental:
+            if not filename_column:
+                raise ValueError(
+                    "Argument 'filename_column' is required for incremental loads."
+                )
+            if write_mode == "overwrite_partitions":
+                # Would drop rows of unchanged files which share a partition
+                raise ValueError(
+                    "Argument write_mode='overwrite_partitions' can't be combined "
+                    "with incremental loads."
+                )
+            file_stats = {}
+            for read_path in [read_paths] if read_paths == file_path else read_paths:
+                file_stats.update(_list_hadoop_files(read_path))
+            manifest = {}
+            if _spark_table_exists(table_name, table_format):
+                manifest = get_ingest_manifest(table_name)
+            new_files = sorted(f for f in file_stats if f not in manifest)
+            changed_files = sorted(
+                f for f, stats in file_stats.items() if manifest.get(f, stats) != stats
+            )
+            if not new_files and not changed_files:
+                logging.info(
+                    f"No new or changed files for table '{table_name}' "
+                    f"in '{file_path}'. Skipping load."
+                )
+                return
+            if manifest:
+                logging.info(
+                    f"Incrementally loading {len(new_files)} new and "
+                    f"{len(changed_files)} changed file(s) to '{table_name}'..."
+                )
+                read_paths = new_files + changed_files
+                if write_mode == "overwrite":
+                    write_args["write_mode"] = "append"
         logging.debug(f"Loading spark table '{table_name}' from file '{file_path}'...")
-        df = spark.read.csv(
-            file_path,
-            header=True,
-            escape='"',
-            quote='"',
-            multiLine=True,
-            inferSchema=True,
-            enforceSchema=False,
-            dateFormat=date_format,
-            timestampFormat=timestamp_format,
-            columnNameOfCorruptRecord="__READ_ERRORS",
-        )
+        reader = spark.read
+        if read_paths != file_path and _is_hadoop_dir(file_path):
+            # Keep partition columns from folders above the selected partitions/files
+            reader = reader.option("basePath", file_path)
+        type_inference_conf = "spark.sql.sources.partitionColumnTypeInference.enabled"
+        # The conf is session-wide and has no per-read equivalent, so it is only
+        # changed while holding a lock, and restored before any other load reads.
+        with _partition_inference_lock:
+            prior_type_inference = spark.conf.get(type_inference_conf, "true")
+            spark.conf.set(type_inference_conf, str(bool(infer_partition_types)).lower())
+            try:
+                df = reader.csv(
+                    read_paths,
+                    header=True,
+                    escape='"',
+                    quote='"',
+                    multiLine=True,
+                    inferSchema=True,
+                    enforceSchema=False,
+                    dateFormat=date_format,
+                    timestampFormat=timestamp_format,
+                    columnNameOfCorruptRecord="__READ_ERRORS",
+                )
+            finally:
+                spark.conf.set(type_inference_conf, prior_type_inference)
         if filename_column:
+            from pyspark.sql.functions import input_file_name
+
             df = df.withColumn(filename_column, input_file_name())
         if df_cleanup_function:
             df = df_cleanup_function(df)
-        create_spark_table(
-            df,
-            table_name,
-            print_n_rows=print_n_rows,
-            run_audit=False,
-            schema_only=schema_only,
+        if changed_files:
+            _replace_rows_from_files(
+                table_name, filename_column, changed_files, df, **write_args
+            )
+            if print_n_rows:
+                sample_spark_table(table_name, n=print_n_rows)
+        else:
+            create_spark_table(
+                df,
+                table_name,
+                print_n_rows=print_n_rows,
+                run_audit=False,
+                schema_only=schema_only,
+                **write_args,
+            )
+        if incremental:
+            _save_ingest_manifest(table_name, {**manifest, **file_stats})
+
+
+def _get_excel_spark_df(file_path, table_name):
+    """
+    Return a spark dataframe for one or more Excel workbooks, streaming each workbook
+    to Parquet in parallel processes before reading with spark.
+
+    Accepts a workbook path, a wildcard such as '/path/to/*.xlsx', or either of those
+    with a sheet name suffix: '/path/to/file.xlsx/#sheet name'. If no sheet name is
+    specified, all sheets are loaded and a 'sheet' column is added.
+
+    The Parquet files are staged in SPARK_STAGING_DIR, so that executors can read them.
+    If that is not a local folder, the files are written to the scratch dir first and
+    then uploaded.
+    """
+    file_path = file_path.replace(SPARK_S3_PREFIX, "s3://")
+    workbook_path, _, sheet_name = file_path.partition("/#")
+    if "*" in workbook_path:
+        folder_path, pattern = workbook_path.rsplit("/", 1)
+        workbook_paths = [
+            f
+            for f in uio.list_files(folder_path)
+            if fnmatch(os.path.basename(f), pattern)
+        ]
+    else:
+        workbook_paths = [workbook_path]
+    staging_dir = _verify_path(os.path.join(SPARK_STAGING_DIR, "excel", table_name))
+    output_dir = staging_dir
+    if not uio.is_local(staging_dir):
+        output_dir = os.path.join(uio.get_scratch_dir(), "excel", table_name)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    logging.debug(
+        f"Converting {len(workbook_paths)} Excel workbook(s) for table '{table_name}' "
+        f"to Parquet in '{output_dir}'..."
+    )
+    parquet_files = pandasutils.excel_files_to_parquet(
+        workbook_paths, output_dir, sheet_names=sheet_name or None
+    )
+    if not parquet_files:
+        raise ValueError(f"No data found in Excel source '{file_path}'.")
+    if output_dir != staging_dir:
+        logging.debug(f"Uploading {len(parquet_files)} file(s) to '{staging_dir}'...")
+        fs, path = _get_hadoop_fs(staging_dir)
+        fs.delete(path, True)
+        local_path = spark._jvm.org.apache.hadoop.fs.Path(output_dir)
+        fs.copyFromLocalFile(True, True, local_path, path)  # Deletes the local copy
+        parquet_files = [
+            f"{staging_dir}/" + os.path.relpath(x, output_dir).replace(os.sep, "/")
+            for x in parquet_files
+        ]
+    reader = spark.read
+    if not sheet_name:
+        reader = reader.option("basePath", staging_dir).option("mergeSchema", "true")
+    return reader.parquet(*parquet_files)
+
+
+def _spark_table_exists(table_name, table_format=None):
+    if (table_format or SPARK_TABLE_FORMAT).lower() == "delta":
+        return _get_delta_table(table_name) is not None
+    return spark._jsparkSession.catalog().tableExists(table_name)
+
+
+def _get_hadoop_fs(file_path):
+    """Return the Hadoop FileSystem and Path objects for file_path."""
+    path = spark._jvm.org.apache.hadoop.fs.Path(file_path)
+    return path.getFileSystem(spark._jsc.hadoopConfiguration()), path
+
+
+def _list_hadoop_files(file_path):
+    """
+    Return a dict of {file_uri: {"size": bytes, "modified": epoch_millis}} for all data
+    files under file_path, using the same file system (and URIs) as Spark readers.
+    Wildcards in file_path (e.g. '/path/to/*.csv') are expanded as Spark would.
+    """
+    fs, path = _get_hadoop_fs(file_path)
+    results = {}
+
+    def _add_file(status):
+        file_uri = status.getPath().toUri().toString()
+        if os.path.basename(file_uri).startswith(("_", ".")):
+            return  # Skip files Spark ignores, e.g. '_SUCCESS' and '.crc' files
+        results[file_uri] = {
+            "size": status.getLen(),
+            "modified": status.getModificationTime(),
+        }
+
+    for match in fs.globStatus(path) or []:  # None if a plain path doesn't exist
+        if not match.isDirectory():
+            _add_file(match)
+            continue
+        file_iter = fs.listFiles(match.getPath(), True)
+        while file_iter.hasNext():
+            _add_file(file_iter.next())
+    return results
+
+
+def _is_hadoop_dir(file_path):
+    """Return True if file_path is an existing folder (and not a file or wildcard)."""
+    fs, path = _get_hadoop_fs(file_path)
+    return fs.isDirectory(path)
+
+
+def _list_hadoop_dirs(folder_path):
+    """Return the URIs of the immediate subfolders of folder_path."""
+    fs, path = _get_hadoop_fs(folder_path)
+    if not fs.exists(path):
+        return []
+    return sorted(
+        status.getPath().toUri().toString()
+        for status in fs.listStatus(path)
+        if status.isDirectory()
+    )
+
+
+def _parse_partition_folder(folder_path):
+    """Return the (key, value) of a 'key=value' folder, or None if not a partition."""
+    name = folder_path.rstrip("/").rsplit("/", 1)[-1]
+    if "=" not in name or name.startswith(("_", ".")):
+        return None
+    key, value = name.split("=", 1)
+    return key, value
+
+
+def _partition_sort_key(value):
+    """Sort numbers numerically and everything else (e.g. ISO dates) as text."""
+    try:
+        return (0, float(value), value)
+    except ValueError:
+        return (1, 0, value)
+
+
+def _partition_value_matches(value, value_filter=None, value_range=None):
+    if callable(value_filter):
+        if not value_filter(value):
+            return False
+    elif isinstance(value_filter, (list, tuple, set)):
+        if value not in [str(x) for x in value_filter]:
+            return False
+    elif value_filter is not None and value != str(value_filter):
+        return False
+    if value_range:
+        min_value, max_value = value_range
+        sort_key = _partition_sort_key(value)
+        if min_value is not None and sort_key < _partition_sort_key(str(min_value)):
+            return False
+        if max_value is not None and sort_key > _partition_sort_key(str(max_value)):
+            return False
+    return True
+
+
+def get_partition_paths(
+    file_path, partition_filters=None, partition_range=None, latest_partitions=None
+):
+    """
+    Return the paths of the 'key=value' partition folders under file_path which match
+    the filters, listing only the folders needed. See load_to_spark_table() for usage.
+    """
+    partition_filters = partition_filters or {}
+    partition_range = partition_range or {}
+    latest_partitions = latest_partitions or {}
+    results = []
+    pending = [file_path]
+    while pending:
+        folder_path = pending.pop(0)
+        partitions = {}
+        for subfolder in _list_hadoop_dirs(folder_path):
+            partition = _parse_partition_folder(subfolder)
+            if partition:
+                key, value = partition
+                partitions.setdefault(key, []).append((value, subfolder))
+        if not partitions:
+            if folder_path != file_path:
+                results.append(folder_path)
+            continue
+        for key, values in sorted(partitions.items()):
+            matches = [
+                (value, subfolder)
+                for value, subfolder in values
+                if _partition_value_matches(
+                    value, partition_filters.get(key), partition_range.get(key)
+                )
+            ]
+            if latest_partitions.get(key):
+                matches = sorted(matches, key=lambda x: _partition_sort_key(x[0]))
+                matches = matches[-int(latest_partitions[key]) :]
+            pending.extend(sorted(subfolder for _, subfolder in matches))
+    return sorted(results)
+
+
+def _get_ingest_manifest_path(table_name):
+    return os.path.join(SPARK_INGEST_MANIFEST_DIR, f"{table_name}.json")
+
+
+def get_ingest_manifest(table_name):
+    """Return the files ingested by incremental loads to the table, with their stats."""
+    manifest_path = _get_ingest_manifest_path(table_name)
+    if not uio.file_exists(manifest_path):
+        return {}
+    return json.loads(uio.get_text_file_contents(manifest_path))
+
+
+def _save_ingest_manifest(table_name, manifest):
+    manifest_path = _get_ingest_manifest_path(table_name)
+    if uio.is_local(manifest_path):
+        uio.create_folder(os.path.dirname(manifest_path))
+    uio.create_text_file(manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def _replace_rows_from_files(
+    table_name,
+    filename_column,
+    file_uris,
+    new_df,
+    table_format=None,
+    partition_by=None,
+    **write_args,
+):
+    """
+    Replace all rows of the table which were loaded from the specified files with the
+    rows of new_df, so that a failure at any point leaves the prior data in place.
+    """
+    from pyspark.sql.functions import col
+
+    logging.info(
+        f"Replacing rows previously loaded from {len(file_uris)} changed file(s) "
+        f"in '{table_name}'..."
+    )
+    is_stale = col(filename_column).isin(list(file_uris))
+    if (table_format or SPARK_TABLE_FORMAT).lower() == "delta":
+        # A single overwrite is one Delta commit: readers see all or none of it.
+        kept_df = get_delta_table_df(table_name).where(~is_stale)
+        _write_delta_table(
+            kept_df.unionByName(new_df), table_name, "overwrite", None, partition_by
         )
+        _invalidate_table(table_name)
+        return
+    # Spark can't overwrite a table it is reading from, so stage the full result first
+    # and only then swap it in, keeping the original until the swap has succeeded.
+    temp_table, backup_table = f"{table_name}__incremental_tmp", f"{table_name}__bak"
+    spark.sql(f"DROP TABLE IF EXISTS {temp_table}")
+    spark.sql(f"DROP TABLE IF EXISTS {backup_table}")
+    kept_df = spark.sql(f"SELECT * FROM {table_name}").where(~is_stale)
+    create_spark_table(
+        kept_df.unionByName(new_df),
+        temp_table,
+        table_format="parquet",
+        partition_by=partition_by,
+    )
+    spark.sql(f"ALTER TABLE {table_name} RENAME TO {backup_table}")
+    try:
+        spark.sql(f"ALTER TABLE {temp_table} RENAME TO {table_name}")
+    except Exception:
+        spark.sql(f"ALTER TABLE {backup_table} RENAME TO {table_name}")
+        raise
+    spark.sql(f"DROP TABLE {backup_table}")
+    _invalidate_table(table_name)
 
 
+@_spark_metrics("save_spark_table")
 @logged("saving '{table_name}' to file")
 def save_spark_table(
     table_name,
@@ -642,10 +2286,19 @@ def save_spark_table(
     compression="gzip",
     schema_only=True,
     overwrite=True,
+    file_format="csv",
 ):
     start_time = time.time()
     file_path = _verify_path(file_path)
-    df = spark.sql(f"SELECT * FROM {table_name}")
+    df = spark.sql(f"SELECT * FROM {_get_sql_table_name(table_name)}")
+    if file_format == "delta":
+        logging.debug(f"Saving spark table '{table_name}' to Delta: '{file_path}'...")
+        if force_single_file:
+            df = df.coalesce(1)
+        df.write.format("delta").save(
+            file_path, mode="overwrite" if overwrite else "append"
+        )
+        return
     if uio.file_exists(os.path.join(file_path, "_SUCCESS")):
         if overwrite:
             logging.warning(
@@ -684,16 +2337,104 @@ def save_spark_table(
         )
 
 
-def get_spark_table_as_pandas(table_name):
+def _to_list(str_or_list):
+    if str_or_list is None:
+        return []
+    elif isinstance(str_or_list, str):
+        return [x.strip() for x in str_or_list.split(",")]
+    else:
+        return list(str_or_list)
+
+
+def _get_spark_table_df(table_name, columns=None, where=None):
+    """Return a spark dataframe for the table, pushing down column and row filters."""
+    col_list = ", ".join(_to_list(columns)) or "*"
+    sql = f"SELECT {col_list} FROM {_get_sql_table_name(table_name)}"
+    if where:
+        sql += f"\nWHERE {where}"
+    return _run_sql(sql)
+
+
+def get_spark_table_as_pandas(table_name, columns=None, where=None):
+    """
+    Return the table as a single pandas dataframe (collected via Arrow).
+
+    Only the requested `columns` (list or comma-separated string) are selected and the
+    optional `where` clause is pushed down to Spark before anything is collected.
+    For tables too large for driver memory, use iter_spark_table_as_pandas().
+    """
     if not pd:
         raise RuntimeError(
             "Could not execute get_pandas_from_spark_table(): Pandas library not loaded."
         )
-    return spark.sql(f"SELECT * FROM {table_name}").toPandas()
+    return _get_spark_table_df(table_name, columns=columns, where=where).toPandas()
+
+
+def iter_spark_table_as_pandas(
+    table_name,
+    columns=None,
+    where=None,
+    chunk_rows=SPARK_ARROW_BATCH_SIZE,
+    max_chunk_mb=None,
+):
+    """
+    Yield the table as a series of pandas dataframes, never holding more than one
+    partition on the driver at a time.
+
+    Rows are streamed with toLocalIterator() and converted to pandas on the driver.
+    (Spark 2.4 has no API to stream Arrow batches a partition at a time, so Arrow is
+    not used here even when spark.sql.execution.arrow.enabled is set.)
+
+    Arguments:
+        table_name {str} -- The spark table to export.
+
+    Keyword Arguments:
+        columns {list or str} -- Columns to select (default: all columns).
+        where {str} -- A SQL filter expression, pushed down to Spark.
+        chunk_rows {int} -- The max number of rows per yielded dataframe.
+        max_chunk_mb {int} -- A memory cap per chunk. When set, the data is
+            repartitioned using the optimizer's size estimate (no extra Spark jobs)
+            so no partition is expected to exceed this size, and chunk_rows is
+            reduced once the size of the first rows collected is known.
+    """
+    if not pd:
+        pandasutils._raise_if_missing_pandas()
+    df = _get_spark_table_df(table_name, columns=columns, where=where)
+    columns = df.columns
+    chunk_rows = int(chunk_rows or SPARK_ARROW_BATCH_SIZE)
+    max_chunk_bytes = max_chunk_mb * 1024 * 1024 if max_chunk_mb else None
+    if max_chunk_bytes:
+        estimated_bytes = _estimate_df_bytes(df)
+        if estimated_bytes:
+            num_partitions = int(estimated_bytes / max_chunk_bytes) + 1
+            if num_partitions > df.rdd.getNumPartitions():
+                logging.info(
+                    f"Repartitioning '{table_name}' export into {num_partitions} "
+                    f"partitions to honor the {max_chunk_mb}MB chunk memory cap..."
+                )
+                df = df.repartition(num_partitions)
+    # With a memory cap, measure a small first chunk before sizing the rest
+    buffer_rows = min(chunk_rows, 1000) if max_chunk_bytes else chunk_rows
+    row_buffer = []
+    for row in df.toLocalIterator():
+        row_buffer.append(tuple(row))
+        if len(row_buffer) >= buffer_rows:
+            chunk = pd.DataFrame.from_records(row_buffer, columns=columns)
+            row_buffer = []
+            if max_chunk_bytes and buffer_rows < chunk_rows:
+                row_bytes = chunk.memory_usage(index=False, deep=True).sum() / len(chunk)
+                if row_bytes:
+                    chunk_rows = max(1, min(chunk_rows, int(max_chunk_bytes / row_bytes)))
+            buffer_rows = chunk_rows
+            yield chunk
+    if row_buffer:
+        yield pd.DataFrame.from_records(row_buffer, columns=columns)
 
 
 # Create Dates table
 def create_calendar_table(table_name, start_date, end_date):
+    from pyspark.sql.types import Row as SparkRow
+
     num_days = (end_date - start_date).days
     date_rows = [
         SparkRow(start_date + datetime.timedelta(days=n)) for n in range(0, num_days)
@@ -742,8 +2483,74 @@ def start_server(dockerized: bool = None, with_jupyter: bool = True, daemon: boo
                     time.sleep(30)
 
 
+def time_to_first_query(metastore_type: str = None, query: str = "SHOW TABLES"):
+    """Start a local spark session and return the seconds elapsed until query completes."""
+    global METASTORE_TYPE
+
+    if metastore_type:
+        METASTORE_TYPE = metastore_type
+    start = time.time()
+    _init_local_spark()
+    spark.sql(query).collect()
+    elapsed = time.time() - start
+    print(f"TIME_TO_FIRST_QUERY={elapsed:.3f}")
+    return elapsed
+
+
+@logged("benchmarking spark startup for metastore types: {metastore_types}")
+def benchmark_startup(
+    metastore_types="InMemory,DerbyInMemory,Derby", query="SHOW TABLES", repeat=1
+):
+    """
+    Return a dictionary of metastore types to their average time to first query.
+
+    Each trial starts a fresh python process (and JVM) so that results are comparable.
+    To include MySQL, the METASTORE_SERVER and credentials env variables must be set.
+    """
+    results = {}
+    for metastore_type in _to_list(metastore_types):
+        timings = []
+        for _ in range(int(repeat)):
+            cmd = [
+                sys.executable,
+                "-m",
+                "slalom.dataops.sparkutils",
+                "time_to_first_query",
+                f"--metastore_type={metastore_type}",
+                f"--query={query}",
+            ]
+            return_code, output = runnow.run(
+                cmd, echo=False, raise_error=False, shell=False
+            )
+            match = re.search(r"TIME_TO_FIRST_QUERY=([0-9.]+)", output or "")
+            if return_code != 0 or not match:
+                logging.warning(
+                    f"Benchmark failed for metastore type '{metastore_type}' "
+                    f"(return code {return_code}):\n{output}"
+                )
+                break
+            timings.append(float(match.group(1)))
+        if timings:
+            results[metastore_type] = round(sum(timings) / len(timings), 3)
+            logging.info(
+                f"Metastore '{metastore_type}' time to first query: "
+                f"{results[metastore_type]}s (avg of {len(timings)})"
+            )
+    return results
+
+
 def main():
-    fire.Fire({"start_server": start_server, "start_jupyter": start_jupyter})
+    import fire
+
+    fire.Fire(
+        {
+            "start_server": start_server,
+            "start_jupyter": start_jupyter,
+            "time_to_first_query": time_to_first_query,
+            "benchmark_startup": benchmark_startup,
+            "compact_spark_table": compact_spark_table,
+        }
+    )
 
 
 if __name__ == "__main__":
@@ -1,13 +1,21 @@
 import datetime
 
-from pyspark.sql.functions import udf
+import pandas as pd
+from pyspark.sql.functions import pandas_udf, udf
 from pyspark.sql import types
 
 
-@udf(types.Long())
+@udf(types.LongType())
 def times_five(value):
     return value * 5
 
 @udf("long")
 def times_six(value):
     return value * 6
+
+@pandas_udf("long")
+def times_seven(value):
+    return value * 7
+
+def times_eight(value: pd.Series) -> pd.Series:
+    return (value * 8).astype(str)
@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+import xmlrunner
+
+# Generous by default, to avoid flaky failures on slow CI runners.
+IMPORT_TIME_BUDGET_SECONDS = float(os.environ.get("IMPORT_TIME_BUDGET_SECONDS", 2.0))
+MODULES = ["anon", "env", "infra", "jobs", "pandasutils", "profiling", "sparkutils"]
+HEAVY_LIBRARIES = [
+    "docker",
+    "dock_r",
+    "fire",
+    "joblib",
+    "pandas",
+    "py4j",
+    "pyarrow",
+    "pyspark",
+    "runnow",
+    "tqdm",
+    "uio",
+]
+
+IMPORT_BENCHMARK_SCRIPT = """
+import importlib, json, sys, time
+start = time.time()
+importlib.import_module("slalom.dataops.{module}")
+elapsed = time.time() - start
+loaded = [name for name in {heavy_libraries!r} if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": loaded}}))
+"""
+
+CONCURRENT_FIRST_USE_SCRIPT = """
+import threading
+from slalom.dataops.lazy_imports import lazy_import
+pd = lazy_import("pandas")
+barrier = threading.Barrier(8)
+errors = []
+def first_use():
+    barrier.wait()
+    try:
+        pd.read_csv
+    except Exception as ex:
+        errors.append(repr(ex))
+threads = [threading.Thread(target=first_use) for _ in range(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(errors)
+"""
+
+
+def _benchmark_import(module):
+    """Import the module in a fresh interpreter and return the timing and libs loaded."""
+    script = IMPORT_BENCHMARK_SCRIPT.format(
+        module=module, heavy_libraries=HEAVY_LIBRARIES
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class ImportTimeTest(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        for module in MODULES:
+            with self.subTest(module=module):
+                result = _benchmark_import(module)
+                self.assertEqual(result["loaded"], [])
+
+    def test_import_time_budget(self):
+        for module in MODULES:
+            with self.subTest(module=module):
+                result = _benchmark_import(module)
+                print(f"slalom.dataops.{module} import time: {result['seconds']:.3f}s")
+                self.assertLess(result["seconds"], IMPORT_TIME_BUDGET_SECONDS)
+
+    def test_lazy_import_concurrent_first_use(self):
+        output = subprocess.run(
+            [sys.executable, "-c", CONCURRENT_FIRST_USE_SCRIPT],
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        ).stdout
+        self.assertEqual(output.strip().splitlines()[-1], "[]")
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output="test-reports"))
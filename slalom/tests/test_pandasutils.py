@@ -0,0 +1,371 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import xmlrunner
+
+from slalom.dataops import pandasutils
+
+HAS_OPENPYXL = importlib.util.find_spec("openpyxl") is not None
+
+
+def _create_workbook(file_path, sheets):
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for sheet_name, rows in sheets.items():
+        sheet = workbook.create_sheet(sheet_name)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(file_path)
+
+
+@unittest.skipUnless(HAS_OPENPYXL, "openpyxl is not installed")
+class ExcelTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "accounts.xlsx")
+        _create_workbook(
+            self.file_path,
+            {
+                "Accounts": [["AccountId", "Name"]]
+                + [[n, f"Account {n}"] for n in range(1, 6)],
+                "Notes & Misc": [["Note"], ["abc"], [None], [123]],
+            },
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_iter_excel_chunks(self):
+        chunks = list(
+            pandasutils.iter_excel_chunks(
+                self.file_path, sheet_names="Accounts", chunk_rows=2
+            )
+        )
+        self.assertEqual([len(df) for _, df in chunks], [2, 2, 1])
+        self.assertEqual(list(chunks[0][1].columns), ["AccountId", "Name"])
+        chunks = list(pandasutils.iter_excel_chunks(self.file_path, usecols=[0]))
+        self.assertEqual([sheet for sheet, _ in chunks], ["Accounts", "Notes & Misc"])
+        self.assertEqual(len(chunks[1][1]), 2)  # Blank rows are skipped
+
+    def test_excel_to_parquet(self):
+        import pyarrow.parquet as pq
+
+        output_dir = os.path.join(self.temp_dir.name, "parquet")
+        output_files = pandasutils.excel_to_parquet(
+            self.file_path, output_dir, chunk_rows=2
+        )
+        self.assertEqual(len(output_files), 2)
+        self.assertIn("sheet=Notes %26 Misc", output_files[1])
+        table = pq.read_table(output_files[0])
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(pq.ParquetFile(output_files[0]).num_row_groups, 3)
+        notes = pq.read_table(output_files[1]).column("Note").to_pylist()
+        self.assertEqual(notes, ["abc", "123"])
+
+    def test_excel_to_parquet_widens_types(self):
+        import pyarrow.parquet as pq
+
+        file_path = os.path.join(self.temp_dir.name, "amounts.xlsx")
+        _create_workbook(
+            file_path,
+            {"Amounts": [["Amount", "Price"], [1, 1], [2, 2], [3, 3.5], ["N/A", 4]]},
+        )
+        output_dir = os.path.join(self.temp_dir.name, "parquet")
+        output_files = pandasutils.excel_to_parquet(file_path, output_dir, chunk_rows=2)
+        table = pq.read_table(output_files[0])
+        self.assertEqual(table.column("Amount").to_pylist(), ["1", "2", "3", "N/A"])
+        self.assertEqual(table.column("Price").to_pylist(), [1.0, 2.0, 3.5, 4.0])
+        self.assertEqual(len(os.listdir(os.path.dirname(output_files[0]))), 1)
+
+    def test_excel_files_to_parquet_unifies_types(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        file_paths = []
+        for name, rows in [
+            ("jan", [["Id", "Amount", "Note"], [1, 10, None], [2, 20, None]]),
+            ("feb", [["Id", "Amount", "Note"], [3, 30.5, 1], [4, None, 2]]),
+        ]:
+            file_paths.append(os.path.join(self.temp_dir.name, f"{name}.xlsx"))
+            _create_workbook(file_paths[-1], {"Amounts": rows})
+        output_dir = os.path.join(self.temp_dir.name, "parquet")
+        output_files = pandasutils.excel_files_to_parquet(file_paths, output_dir)
+        schemas = [pq.read_schema(x) for x in output_files]
+        for schema in schemas:
+            self.assertEqual(schema.field("Amount").type, pa.float64())
+            self.assertEqual(schema.field("Note").type, schemas[1].field("Note").type)
+        self.assertTrue(pa.types.is_integer(schemas[0].field("Note").type))
+        dataset = pq.ParquetDataset(output_dir)
+        self.assertEqual(dataset.read().num_rows, 4)
+        self.assertEqual(len(os.listdir(os.path.dirname(output_files[0]))), 2)
+
+
+class PandasCacheTest(unittest.TestCase):
+    def test_get_pandas_df_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_dir = os.path.join(temp_dir, "cache")
+            csv_path = os.path.join(temp_dir, "accounts.csv")
+            with open(csv_path, "w") as f:
+                f.write("AccountId,Name\n1,Acme\n2,Initech\n")
+            original_dir = pandasutils.PANDAS_CACHE_DIR
+            pandasutils.PANDAS_CACHE_DIR = cache_dir
+            try:
+                stats = pandasutils.get_pandas_cache_stats()
+                df = pandasutils.get_pandas_df(csv_path)
+                cached_df = pandasutils.get_pandas_df(csv_path)
+                self.assertTrue(df.equals(cached_df))
+                pandasutils.get_pandas_df(csv_path, usecols=["Name"])
+                new_stats = pandasutils.get_pandas_cache_stats()
+                self.assertEqual(new_stats["hits"] - stats["hits"], 1)
+                self.assertEqual(new_stats["misses"] - stats["misses"], 2)
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+                pandasutils._evict_pandas_cache(cache_dir, max_mb=0)
+                self.assertEqual(os.listdir(cache_dir), [])
+            finally:
+                pandasutils.PANDAS_CACHE_DIR = original_dir
+
+
+class ReadCsvDirTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_dir = self.temp_dir.name
+        for part in range(12):
+            with open(os.path.join(self.csv_dir, f"part-{part:05d}.csv"), "w") as f:
+                f.write("PartNum,Value\n")
+                f.writelines(f"{part},{n}\n" for n in range(part + 1))
+        open(os.path.join(self.csv_dir, "_SUCCESS"), "w").close()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_csv_dir(self):
+        df = pandasutils.read_csv_dir(self.csv_dir, max_parallel=4)
+        self.assertEqual(len(df), sum(range(1, 13)))
+        self.assertEqual(list(df["PartNum"]), sorted(df["PartNum"]))
+        df = pandasutils.read_csv_dir(self.csv_dir, usecols=["Value"])
+        self.assertEqual(list(df.columns), ["Value"])
+
+    def test_read_csv_dir_fresh_interpreter(self):
+        # In a new process pandas is still lazy-loaded when the reader threads start
+        script = (
+            "from slalom.dataops import pandasutils; "
+            f"print(len(pandasutils.read_csv_dir({self.csv_dir!r}, max_parallel=8)))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+            cwd=os.path.join(os.path.dirname(__file__), "..", ".."),
+        ).stdout
+        self.assertEqual(output.strip().splitlines()[-1], str(sum(range(1, 13))))
+
+    def test_iter_csv_dir(self):
+        chunks = list(pandasutils.iter_csv_dir(self.csv_dir))
+        self.assertEqual([len(df) for df in chunks], list(range(1, 13)))
+        chunks = list(pandasutils.iter_csv_dir(self.csv_dir, chunksize=5))
+        self.assertEqual(len(chunks), sum((n + 4) // 5 for n in range(1, 13)))
+        self.assertLessEqual(max(len(df) for df in chunks), 5)
+
+    def test_read_csv_dir_out_of_core(self):
+        import pyarrow.dataset
+
+        dataset_dir = os.path.join(self.temp_dir.name, "arrow")
+        dataset = pandasutils.read_csv_dir(
+            self.csv_dir, out_of_core=True, dataset_dir=dataset_dir
+        )
+        self.assertEqual(dataset.count_rows(), sum(range(1, 13)))
+        df = pandasutils.read_arrow_dataset(
+            dataset, columns=["Value"], filters=[("PartNum", "==", 11)]
+        )
+        self.assertEqual(list(df.columns), ["Value"])
+        self.assertEqual(list(df["Value"]), list(range(12)))
+        df = pandasutils.read_arrow_dataset(
+            dataset, filters=pyarrow.dataset.field("Value") > 9, limit=2
+        )
+        self.assertEqual(len(df), 2)
+
+    def test_arrow_dataset_mixed_types(self):
+        import pyarrow as pa
+
+        with tempfile.TemporaryDirectory() as csv_dir:
+            for part, (value, count) in enumerate([("1", "5"), ("3.5", "N/A")]):
+                with open(os.path.join(csv_dir, f"part-{part:05d}.csv"), "w") as f:
+                    f.write(f"Value,Count\n{value},{count}\n")
+            with open(os.path.join(csv_dir, "part-00002.csv"), "w") as f:
+                f.write("Value,Count\n")
+                f.writelines(f"{n},{n}\n" for n in range(2000))
+                f.write("x,1\n")  # Conflicts only after the first block
+            dataset_dir = os.path.join(self.temp_dir.name, "mixed")
+            dataset = pandasutils.csv_dir_to_arrow_dataset(
+                csv_dir, dataset_dir=dataset_dir, block_size_mb=0.01
+            )
+            table = dataset.to_table()
+            self.assertEqual(table.schema.field("Value").type, pa.string())
+            self.assertEqual(table.schema.field("Count").type, pa.int64())
+            self.assertEqual(table.column("Value").to_pylist()[:2], ["1", "3.5"])
+            self.assertEqual(table.num_rows, 2003)
+            with open(os.path.join(csv_dir, "part-00003.csv"), "w") as f:
+                f.write("Other\n1\n")
+            with self.assertRaises(Exception):
+                pandasutils.csv_dir_to_arrow_dataset(csv_dir, dataset_dir=dataset_dir)
+            self.assertEqual(os.listdir(dataset_dir), [])
+
+    def test_read_csv_dir_preallocated(self):
+        expected_df = pandasutils.read_csv_dir(self.csv_dir)
+        df = pandasutils.read_csv_dir(self.csv_dir, preallocate=True, chunksize=4)
+        self.assertTrue(df.equals(expected_df))
+
+
+class CsvEngineTest(unittest.TestCase):
+    def test_sniff_and_record_engine(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            csv_path = os.path.join(temp_dir, "accounts.csv")
+            with open(csv_path, "w", encoding="latin-1") as f:
+                f.write('AccountId;Name\n1;"Café; Bar"\n2;Initech\n')
+            self.assertEqual(
+                pandasutils.sniff_csv_format(csv_path),
+                {"encoding": "latin-1", "sep": ";", "quotechar": '"'},
+            )
+            df = pandasutils.get_pandas_df(csv_path, use_cache=False)
+            self.assertEqual(list(df["Name"]), ["Café; Bar", "Initech"])
+            record = pandasutils.get_csv_engine_records()[csv_path]
+            self.assertEqual(record["engine"], "c")
+
+    def test_engine_fallback(self):
+        read_csv = pandasutils.pd.read_csv
+        engines_tried = []
+
+        def fake_read_csv(read_path, engine, **kwargs):
+            engines_tried.append(engine)
+            if engine == "c":
+                raise ValueError("Error tokenizing data. C error")
+            return read_csv(read_path, engine=engine, **kwargs)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            csv_path = os.path.join(temp_dir, "accounts.csv")
+            with open(csv_path, "w") as f:
+                f.write("AccountId,Name\n1,Acme\n2,Initech\n")
+            with mock.patch.object(pandasutils.pd, "read_csv", fake_read_csv):
+                df = pandasutils._read_csv_with_best_engine(csv_path)
+                self.assertEqual(len(df), 2)
+                self.assertEqual(engines_tried, ["c", "python"])
+                record = pandasutils.get_csv_engine_records()[csv_path]
+                self.assertEqual(record["engine"], "python")
+                engines_tried.clear()
+                pandasutils._read_csv_with_best_engine(csv_path)
+                self.assertEqual(engines_tried, ["python"])  # Recorded engine first
+
+                other_path = os.path.join(temp_dir, "other.csv")
+                with open(other_path, "w") as f:
+                    f.write("Id\n1\n")
+                engines_tried.clear()
+                with mock.patch.object(
+                    pandasutils, "PANDAS_CSV_ENGINES", [" python", "c", ""]
+                ):
+                    pandasutils._read_csv_with_best_engine(other_path)
+                self.assertEqual(engines_tried, ["python"])
+
+
+class MemUsageTest(unittest.TestCase):
+    def test_optimize_pandas_mem_usage(self):
+        import numpy as np
+        import pandas as pd
+
+        num_rows = 10000
+        df = pd.DataFrame(
+            {
+                "Id": np.arange(num_rows),
+                "Half": np.arange(num_rows) / 2,
+                "Random": np.random.rand(num_rows),
+                "State": pd.Series(["CA", "NY", "WA", "OR"] * (num_rows // 4)),
+                "Rare": [1.5 if n % 100 == 0 else None for n in range(num_rows)],
+            }
+        )
+        new_df, report = pandasutils.optimize_pandas_mem_usage(
+            df, "test_df", print_fn=lambda msg: None
+        )
+        self.assertLess(report["after_bytes"], report["before_bytes"] / 2)
+        self.assertEqual(str(new_df["Id"].dtype), "uint16")
+        self.assertEqual(str(new_df["Half"].dtype), "float32")
+        self.assertEqual(str(new_df["Random"].dtype), "float64")  # Avoid precision loss
+        self.assertEqual(str(new_df["State"].dtype), "category")
+        self.assertIsInstance(new_df["Rare"].dtype, pd.SparseDtype)
+        self.assertIn("Dataframe 'test_df' mem usage", report["after"])
+        self.assertTrue((new_df["Random"] == df["Random"]).all())
+        self.assertEqual(str(df["Id"].dtype), "int64")  # Original is unchanged
+
+
+class S3CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.s3_objects = s3_objects = {
+            "s3://bucket/a.csv": b"a,b\n1,2\n",
+            "s3://bucket/c.csv": b"c\n3\n",
+        }
+
+        def download_s3_file(s3_path, local_path):
+            with open(local_path, "wb") as f:
+                f.write(s3_objects[s3_path])
+
+        def get_s3_object_info(s3_path):
+            contents = s3_objects[s3_path]
+            return {"size": len(contents), "etag": str(hash(contents))}
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_dir = os.path.join(temp_dir.name, "cache")
+        self.dataset_dir = os.path.join(temp_dir.name, "dataset")
+        for patcher in [
+            mock.patch.object(
+                pandasutils.uio, "download_s3_file", side_effect=download_s3_file
+            ),
+            mock.patch.object(
+                pandasutils, "_get_s3_object_info", side_effect=get_s3_object_info
+            ),
+            mock.patch.object(pandasutils, "S3_CACHE_DIR", self.cache_dir),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cached_s3_file(self):
+        s3_objects, download_fn = self.s3_objects, pandasutils.uio.download_s3_file
+        local_path = pandasutils.get_cached_s3_file("s3://bucket/a.csv")
+        self.assertEqual(local_path, pandasutils.get_cached_s3_file("s3://bucket/a.csv"))
+        self.assertEqual(download_fn.call_count, 1)
+        s3_objects["s3://bucket/a.csv"] = b"a,b\n1,2\n3,4\n"
+        pandasutils.get_cached_s3_file("s3://bucket/a.csv")
+        self.assertEqual(download_fn.call_count, 2)
+        with open(local_path, "rb") as f:
+            self.assertEqual(f.read(), s3_objects["s3://bucket/a.csv"])
+        with mock.patch.object(pandasutils, "S3_CACHE_MAX_MB", 0):
+            other_path = pandasutils.get_cached_s3_file("s3://bucket/c.csv")
+        self.assertFalse(os.path.exists(local_path))
+        self.assertTrue(os.path.exists(other_path))
+
+    def test_csv_dir_to_arrow_dataset_from_s3(self):
+        for n in range(4):
+            self.s3_objects[f"s3://bucket/data/part-{n}.csv"] = f"id\n{n}\n".encode()
+        data_files = sorted(
+            x for x in self.s3_objects if x.startswith("s3://bucket/data")
+        )
+        with mock.patch.object(
+            pandasutils, "_list_csv_dir", return_value=data_files
+        ), mock.patch.object(pandasutils, "S3_CACHE_MAX_MB", 0):
+            dataset = pandasutils.csv_dir_to_arrow_dataset(
+                "s3://bucket/data", dataset_dir=self.dataset_dir
+            )
+        self.assertEqual(
+            sorted(dataset.to_table().column("id").to_pylist()), [0, 1, 2, 3]
+        )
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)  # Only the last file is kept
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output="test-reports"))
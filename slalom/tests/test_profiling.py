@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+import xmlrunner
+
+from slalom.dataops import profiling
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        profiling.clear_profile_records()
+
+    def test_nested_blocks(self):
+        with profiling.profile_block("outer", log_fn=None):
+            with profiling.profile_block("inner", log_fn=None):
+                data = [0] * (4 * 1024 * 1024)  # About 32MB of pointers
+                del data
+            with profiling.profile_block("small", log_fn=None):
+                data = [0] * 1024
+        records = {x["path"]: x for x in profiling.get_profile_records()}
+        self.assertEqual(sorted(records), ["outer", "outer/inner", "outer/small"])
+        self.assertEqual(records["outer/inner"]["depth"], 1)
+        self.assertGreater(records["outer"]["traced_peak_mb"], 20)
+        if hasattr(tracemalloc, "reset_peak"):
+            self.assertGreater(records["outer/inner"]["traced_peak_mb"], 20)
+            self.assertLess(records["outer/small"]["traced_peak_mb"], 20)
+        else:  # Python < 3.9: only the outermost block's traced peak is known
+            self.assertIsNone(records["outer/inner"].get("traced_peak_mb"))
+            self.assertIsNone(records["outer/small"].get("traced_peak_mb"))
+        summary = profiling.get_profile_summary().splitlines()
+        block_width = len(summary[1].split()[0])
+        self.assertEqual(
+            [line[:block_width].rstrip() for line in summary[2:]],
+            ["outer", "  inner", "  small"],
+        )
+
+    def test_decorator_and_json(self):
+        @profiling.profiled(log_fn=None)
+        def add_one(value):
+            return value + 1
+
+        self.assertEqual(add_one(1), 2)
+        self.assertEqual(profiling.get_profile_records()[0]["name"], "add_one()")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            json_path = os.path.join(temp_dir, "profile.json")
+            profiling.save_profile_json(json_path)
+            with open(json_path) as f:
+                self.assertEqual(json.load(f)[0]["name"], "add_one()")
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output="test-reports"))
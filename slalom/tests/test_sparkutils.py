@@ -0,0 +1,268 @@
+import glob
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import xmlrunner
+
+from slalom.dataops import sparkutils
+
+
+class SparkUtilsTest(unittest.TestCase):
+    def test_referenced_tables(self):
+        sql = """
+            SELECT a.AccountId, o.Amount
+            FROM accounts a
+            LEFT JOIN Staging.Opportunities o ON a.AccountId = o.AccountId
+            WHERE a.AccountId IN (SELECT AccountId FROM active_accounts)
+        """
+        self.assertEqual(
+            sparkutils._get_referenced_tables(sql),
+            ["accounts", "active_accounts", "staging.opportunities"],
+        )
+
+    def test_query_cache_key(self):
+        original_versions = dict(sparkutils._table_versions)
+        try:
+            key = sparkutils._get_query_cache_key("SELECT *\n  FROM t;", ["t"])
+            self.assertEqual(
+                key, sparkutils._get_query_cache_key("SELECT * FROM t", ["t"])
+            )
+            sparkutils._invalidate_table("T")
+            self.assertNotEqual(
+                key, sparkutils._get_query_cache_key("SELECT * FROM t", ["t"])
+            )
+        finally:
+            sparkutils._table_versions.clear()
+            sparkutils._table_versions.update(original_versions)
+
+    def test_run_diagnostic(self):
+        logger = logging.getLogger("test_run_diagnostic")
+        logger.setLevel(logging.WARNING)
+        calls = []
+        self.assertIsNone(
+            sparkutils._run_diagnostic(lambda: calls.append(1), log_fn=logger.debug)
+        )
+        self.assertIsNone(
+            sparkutils._run_diagnostic(
+                lambda: calls.append(1), log_level=logging.INFO, log_fn=logger.info
+            )
+        )
+        self.assertEqual(calls, [])
+        self.assertFalse(sparkutils._is_log_enabled(log_fn=logger.info))
+        self.assertTrue(sparkutils._is_log_enabled(log_fn=print))
+        result = sparkutils._run_diagnostic(
+            lambda: calls.append(1) or "done", log_fn=logger.warning, background=False
+        )
+        self.assertEqual((result, calls), ("done", [1]))
+
+    def test_udf_manifest(self):
+        source_dir = os.path.join(
+            os.path.dirname(__file__), "resources", "spark_udf_tests", "udfs"
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            module_dir = shutil.copytree(
+                source_dir,
+                os.path.join(temp_dir, "udfs"),
+                ignore=shutil.ignore_patterns("__pycache__"),
+            )
+            manifest = sparkutils.get_udf_manifest(module_dir)
+            self.assertEqual(
+                sorted(manifest),
+                ["times_eight", "times_five", "times_seven", "times_six"],
+            )
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(module_dir, sparkutils.UDF_MANIFEST_FILE_NAME)
+                )
+            )
+            with mock.patch.object(sparkutils, "_get_file_udf_names") as parse_fn:
+                self.assertEqual(sparkutils.get_udf_manifest(module_dir), manifest)
+                self.assertEqual(parse_fn.call_count, 0)  # Served from the cache
+            with mock.patch.dict(
+                sparkutils._udf_manifest, manifest, clear=True
+            ), mock.patch.object(sparkutils, "register_udfs") as register_fn:
+                udf_names = sparkutils.register_udfs_for_sql(
+                    "SELECT times_five(a), TIMES_SIX (b), upper(c), times_eight FROM t"
+                )
+                self.assertEqual(sorted(udf_names), ["times_five", "times_six"])
+                register_fn.assert_called_once_with(udf_names)
+
+    def test_table_dependencies(self):
+        table_sqls = [
+            ("accounts", "SELECT * FROM raw_accounts"),
+            ("opps", "SELECT * FROM raw_opps"),
+            ("features", "SELECT * FROM Accounts JOIN opps USING (AccountId)"),
+        ]
+        self.assertEqual(
+            sparkutils.get_table_dependencies(table_sqls),
+            {"accounts": set(), "opps": set(), "features": {"accounts", "opps"}},
+        )
+
+    def test_create_spark_sql_tables_order(self):
+        built = []
+        original_fn = sparkutils._create_spark_sql_table_in_pool
+        sparkutils._create_spark_sql_table_in_pool = (
+            lambda table_name, sql, pool_name, **kwargs: built.append(table_name)
+        )
+        try:
+            completed = sparkutils.create_spark_sql_tables(
+                {
+                    "features": "SELECT * FROM accounts JOIN opps",
+                    "accounts": "SELECT * FROM raw_accounts",
+                    "opps": "SELECT * FROM raw_opps",
+                },
+                max_parallel=2,
+            )
+            self.assertEqual(completed[-1], "features")
+            self.assertEqual(sorted(built), ["accounts", "features", "opps"])
+            with self.assertRaises(ValueError):
+                sparkutils.create_spark_sql_tables(
+                    {"a": "SELECT * FROM b", "b": "SELECT * FROM a"}
+                )
+        finally:
+            sparkutils._create_spark_sql_table_in_pool = original_fn
+
+    def test_register_delta_tables(self):
+        registered = []
+        listed = []
+
+        def list_dirs(folder_path):
+            listed.append(os.path.relpath(folder_path, delta_dir))
+            if not os.path.isdir(folder_path):
+                return []
+            return sorted(
+                os.path.join(folder_path, x)
+                for x in os.listdir(folder_path)
+                if os.path.isdir(os.path.join(folder_path, x))
+            )
+
+        with tempfile.TemporaryDirectory() as delta_dir:
+            for table_path in ["accounts", "staging/opps"]:
+                log_dir = os.path.join(delta_dir, table_path, "_delta_log")
+                os.makedirs(log_dir)
+                with open(os.path.join(log_dir, "00000.json"), "w") as f:
+                    f.write("{}")
+            os.makedirs(os.path.join(delta_dir, "accounts", "year=2020", "month=1"))
+            with mock.patch.object(
+                sparkutils, "_register_delta_table", registered.append
+            ), mock.patch.object(
+                sparkutils, "_list_hadoop_dirs", list_dirs
+            ), mock.patch.object(
+                sparkutils, "SPARK_DELTA_DIR", delta_dir
+            ):
+                table_names = sparkutils.register_delta_tables()
+        self.assertNotIn(os.path.join("accounts", "year=2020"), listed)
+        self.assertEqual(table_names, ["accounts", "staging.opps"])
+        self.assertEqual(registered, table_names)
+        self.assertEqual(
+            [sparkutils.get_delta_view_name(x) for x in table_names],
+            ["accounts", "staging__opps"],
+        )
+
+    def test_partition_paths(self):
+        original_fn = sparkutils._list_hadoop_dirs
+        sparkutils._list_hadoop_dirs = lambda folder_path: sorted(
+            os.path.join(folder_path, x)
+            for x in os.listdir(folder_path)
+            if os.path.isdir(os.path.join(folder_path, x))
+        )
+        with tempfile.TemporaryDirectory() as root:
+            for dry_run in ["True", "False"]:
+                for batch in range(1, 11):
+                    os.makedirs(os.path.join(root, f"dry-run={dry_run}/batch={batch}"))
+            try:
+                paths = sparkutils.get_partition_paths(
+                    root,
+                    partition_filters={"dry-run": False},
+                    latest_partitions={"batch": 3},
+                )
+                self.assertEqual(
+                    [os.path.relpath(x, root) for x in paths],
+                    [f"dry-run=False/batch={n}" for n in [10, 8, 9]],
+                )
+                paths = sparkutils.get_partition_paths(
+                    root,
+                    partition_filters={"dry-run": lambda x: x == "True"},
+                    partition_range={"batch": (2, 4)},
+                )
+                self.assertEqual(len(paths), 3)
+                leaf_folder = os.path.join(root, "dry-run=True", "batch=1")
+                self.assertEqual(sparkutils.get_partition_paths(leaf_folder), [])
+            finally:
+                sparkutils._list_hadoop_dirs = original_fn
+
+    def test_incremental_file_listing(self):
+        def status(file_path):
+            uri = mock.Mock(**{"toString.return_value": file_path})
+            return mock.Mock(
+                **{
+                    "getPath.return_value.toUri.return_value": uri,
+                    "isDirectory.return_value": os.path.isdir(file_path),
+                    "getLen.return_value": os.path.getsize(file_path),
+                    "getModificationTime.return_value": 0,
+                }
+            )
+
+        def list_files(folder_path, recursive):
+            folder_path = folder_path.toUri().toString()
+            file_paths = [
+                os.path.join(folder, x)
+                for folder, _, files in os.walk(folder_path)
+                for x in files
+            ]
+            file_iter = iter(sorted(file_paths))
+            next_paths = [next(file_iter, None)]
+
+            def next_status():
+                file_path, next_paths[0] = next_paths[0], next(file_iter, None)
+                return status(file_path)
+
+            return mock.Mock(hasNext=lambda: next_paths[0] is not None, next=next_status)
+
+        fs = mock.Mock()
+        fs.globStatus = lambda path: [status(x) for x in sorted(glob.glob(path))] or None
+        fs.listFiles = list_files
+        with tempfile.TemporaryDirectory() as root:
+            for file_name in ["a.csv", "b.csv", "notes.txt", "sub/c.csv", "sub/_SUCCESS"]:
+                os.makedirs(os.path.dirname(os.path.join(root, file_name)), exist_ok=True)
+                with open(os.path.join(root, file_name), "w") as f:
+                    f.write("id\n1\n")
+            with mock.patch.object(sparkutils, "_get_hadoop_fs", lambda x: (fs, x)):
+                for file_path, expected in [
+                    ("*.csv", ["a.csv", "b.csv"]),
+                    ("su*", ["sub/c.csv"]),
+                    ("", ["a.csv", "b.csv", "notes.txt", "sub/c.csv"]),
+                    ("missing", []),
+                ]:
+                    file_stats = sparkutils._list_hadoop_files(
+                        os.path.join(root, file_path)
+                    )
+                    self.assertEqual(
+                        sorted(os.path.relpath(x, root) for x in file_stats), expected
+                    )
+        with self.assertRaises(ValueError):
+            sparkutils.load_to_spark_table(
+                "accounts",
+                "/data/accounts/*.csv",
+                incremental=True,
+                write_mode="overwrite_partitions",
+            )
+
+    def test_compaction_paths(self):
+        self.assertEqual(
+            sparkutils._get_partition_spec_sql("year=2020/name=O%27Brien"),
+            "year='2020', name='O\\'Brien'",
+        )
+        new_path = sparkutils._get_compacted_path("s3a://bucket/t/year=2020/")
+        self.assertRegex(new_path, r"^s3a://bucket/t/_year=2020\.compacted-[0-9a-f]{8}$")
+        newer_path = sparkutils._get_compacted_path(new_path)
+        self.assertNotEqual(newer_path, new_path)
+        self.assertRegex(newer_path, r"/_year=2020\.compacted-[0-9a-f]{8}$")
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output="test-reports"))